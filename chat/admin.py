@@ -1,16 +1,35 @@
 from django.contrib import admin
-from .models import User, Group, File, Message
+from .models import User, Group, File, Message, ArchivedMessage, Conversation
+from .search import index_user, index_group
+from .presence import is_online
+from .cache import group_members_cache
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ['username', 'display_name', 'is_online']
+    list_display = ['username', 'display_name', 'online']
     search_fields = ['username', 'display_name']
 
+    @admin.display(boolean=True, description='Online')
+    def online(self, obj):
+        return is_online(obj.id)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        index_user(obj)
+
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
     list_display = ['name', 'creator', 'created_at']
     search_fields = ['name']
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        index_group(obj)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        group_members_cache.invalidate(form.instance.id)
+
 @admin.register(File)
 class FileAdmin(admin.ModelAdmin):
     list_display = ['file', 'file_type', 'uploaded_at']
@@ -18,4 +37,12 @@ class FileAdmin(admin.ModelAdmin):
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ['sender', 'recipient', 'group', 'content', 'timestamp']
-    search_fields = ['content']
\ No newline at end of file
+    search_fields = ['content']
+
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ['sender', 'recipient', 'group', 'content', 'timestamp', 'archived_at']
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ['user', 'peer', 'group', 'last_message_at', 'unread_count']
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from .models import ArchivedMessage, File, Message
+from .serializers import MESSAGE_ROW_FIELDS
+
+# Highest archived id. Archiving walks ids upwards and moves every message up
+# to the batch it is on, so everything at or below this is in the archive and
+# everything above it is still in Message. A stale value would skip archived
+# rows when catching up, so it is only cached when the cache is shared (Redis)
+# and archive_messages, running in another process, can update it.
+ARCHIVE_BOUNDARY_KEY = 'archive:boundary'
+ARCHIVE_BOUNDARY_TTL = 60 * 5
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVED_FIELDS = ['id', 'sender_id', 'recipient_id', 'group_id', 'content', 'timestamp', 'delivered_at', 'read_at']
+
+
+def archive_boundary():
+    boundary = cache.get(ARCHIVE_BOUNDARY_KEY) if settings.REDIS_URL else None
+    if boundary is None:
+        boundary = ArchivedMessage.objects.aggregate(boundary=models.Max('id'))['boundary'] or 0
+        if settings.REDIS_URL:
+            # add, not set: a batch archived since the query has already stored the newer boundary.
+            cache.add(ARCHIVE_BOUNDARY_KEY, boundary, ARCHIVE_BOUNDARY_TTL)
+    return boundary
+
+
+def archive_batch(up_to_id, size=ARCHIVE_BATCH_SIZE):
+    """Move the oldest ``size`` messages with ids up to ``up_to_id`` into the archive; returns how many moved.
+
+    Each batch is its own short transaction, so senders only ever wait for one batch.
+    """
+    with transaction.atomic():
+        rows = list(Message.objects.filter(id__lte=up_to_id).order_by('id').values(*ARCHIVED_FIELDS)[:size])
+        if not rows:
+            return 0
+        first, last = rows[0]['id'], rows[-1]['id']
+        ArchivedMessage.objects.bulk_create([ArchivedMessage(**row) for row in rows])
+        File.objects.filter(message_id__gte=first, message_id__lte=last).update(
+            archived_message_id=models.F('message_id'), message=None
+        )
+        Message.objects.filter(id__gte=first, id__lte=last).delete()
+    if settings.REDIS_URL:
+        cache.set(ARCHIVE_BOUNDARY_KEY, last, ARCHIVE_BOUNDARY_TTL)
+    return len(rows)
+
+
+def history_page(scope, after_id, before_id, limit):
+    """One oldest-first page of message rows matching ``scope``, read through to the archive when the cursor reaches it.
+
+    ``after_id`` catches up, ``before_id`` scrolls back and neither returns the newest page.
+    """
+    hot = Message.objects.filter(scope).values(*MESSAGE_ROW_FIELDS)
+    boundary = archive_boundary()
+    if not boundary:
+        if after_id:
+            return list(hot.filter(id__gt=after_id).order_by('id')[:limit])
+        if before_id:
+            hot = hot.filter(id__lt=before_id)
+        return list(hot.order_by('-id')[:limit])[::-1]
+
+    archived = ArchivedMessage.objects.filter(scope).values(*MESSAGE_ROW_FIELDS)
+    if after_id:
+        rows = []
+        if after_id < boundary:
+            rows = list(archived.filter(id__gt=after_id).order_by('id')[:limit])
+        if len(rows) < limit:
+            rows += hot.filter(id__gt=max(after_id, boundary)).order_by('id')[:limit - len(rows)]
+        return rows
+
+    rows = []
+    if not before_id or before_id > boundary + 1:
+        recent = hot.filter(id__lt=before_id) if before_id else hot
+        rows = list(recent.order_by('-id')[:limit])
+    if len(rows) < limit:
+        older = archived.filter(id__lt=before_id) if before_id else archived
+        rows += older.order_by('-id')[:limit - len(rows)]
+    return rows[::-1]
@@ -0,0 +1,100 @@
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from .models import Blob, File
+import hashlib
+import os
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def blob_name(sha256, extension=''):
+    """Storage name for content with this digest, fanned out so no directory grows unbounded."""
+    return os.path.join('blobs', sha256[:2], sha256[2:4], f"{sha256}{extension.lower()[:10]}")
+
+
+def hash_file(file):
+    """SHA-256 of an uploaded file, read in blocks; leaves the file rewound."""
+    hasher = hashlib.sha256()
+    for chunk in file.chunks(HASH_BLOCK_SIZE):
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def blob_files(blob):
+    names = {variant['file'] for variant in blob.variants.values()}
+    names.add(blob.path)
+    return names
+
+
+def acquire_blob(sha256):
+    """Add a reference to already stored content, or return None if it is new."""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256=sha256).first()
+        if blob is not None:
+            Blob.objects.filter(id=blob.id).update(refcount=models.F('refcount') + 1)
+            blob.refcount += 1
+    return blob
+
+
+def store_blob(sha256, size, extension, status, write):
+    """Reference the content for ``sha256``, calling ``write(name)`` to store it only when it is new.
+
+    ``write`` returns the name the bytes were actually stored under. Identical
+    uploads therefore cost one hash pass and no second write.
+    """
+    blob = acquire_blob(sha256)
+    if blob is not None:
+        return blob, False
+    name = blob_name(sha256, extension)
+    # Without a row, a file already under the name was left by a crash or is still being written by a
+    # concurrent upload of the same bytes, so it is only reused once its contents check out.
+    if not stored_intact(name, sha256, size):
+        # Saving picks another name when the existing file is in the way; a rename replaces it.
+        name = write(name)
+    with transaction.atomic():
+        blob, created = Blob.objects.select_for_update().get_or_create(
+            sha256=sha256, defaults={'path': name, 'size': size, 'status': status}
+        )
+        Blob.objects.filter(id=blob.id).update(refcount=models.F('refcount') + 1)
+    if not created and name not in blob_files(blob):
+        # The other upload registered the blob, so this copy is never referenced.
+        default_storage.delete(name)
+    return blob, created
+
+
+def stored_intact(name, sha256, size):
+    if not default_storage.exists(name) or default_storage.size(name) != size:
+        return False
+    with default_storage.open(name, 'rb') as stored:
+        return hash_file(stored) == sha256
+
+
+def release_blob(blob_id):
+    """Drop one reference; after the last one commits, the blob and its files are deleted."""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(id=blob_id).first()
+        if blob is None:
+            return
+        Blob.objects.filter(id=blob_id, refcount__gt=0).update(refcount=models.F('refcount') - 1)
+        if blob.refcount > 1 or File.objects.filter(blob_id=blob_id).exists():
+            return
+        transaction.on_commit(lambda: delete_blob(blob_id))
+
+
+def delete_blob(blob_id):
+    """Delete an unreferenced blob's row and files together, under the row lock ``acquire_blob`` takes.
+
+    An upload of the same content meanwhile either re-acquired the row first,
+    and the blob stays, or waits for this to commit and then finds neither
+    row nor files and writes its own.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(id=blob_id, refcount=0).first()
+        if blob is None or File.objects.filter(blob_id=blob_id).exists():
+            return False
+        blob.delete()
+        for name in blob_files(blob):
+            if default_storage.exists(name):
+                default_storage.delete(name)
+    return True
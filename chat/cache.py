@@ -0,0 +1,56 @@
+from django.core.cache import cache
+import time
+
+
+class VersionedCache:
+    """Cache entries grouped under a namespace and scope, invalidated by bumping a generation.
+
+    The generation counter lives in the shared cache next to the entries, so
+    one ``invalidate`` call retires every key in the scope for all workers at
+    once; old entries are never read again and simply expire.
+    """
+
+    def __init__(self, namespace, timeout):
+        self.namespace = namespace
+        self.timeout = timeout
+
+    def _generation_key(self, scope):
+        return f'{self.namespace}:{scope}:generation'
+
+    def _generation(self, scope):
+        key = self._generation_key(scope)
+        generation = cache.get(key)
+        if generation is None:
+            # Seed from the clock so an evicted counter can never fall back to an old generation.
+            cache.add(key, time.time_ns(), timeout=None)
+            generation = cache.get(key)
+        return generation
+
+    def key(self, scope, *parts):
+        return ':'.join([self.namespace, str(scope), str(self._generation(scope)), *map(str, parts)])
+
+    def get_or_set(self, scope, fill, *parts):
+        """The cached value, or ``fill()`` stored under the generation read before it ran.
+
+        The key is built once: if a writer invalidates while ``fill`` is
+        querying, its possibly stale result lands under the retired
+        generation and is never read, instead of under the new one.
+        """
+        key = self.key(scope, *parts)
+        value = cache.get(key)
+        if value is None:
+            value = fill()
+            cache.set(key, value, timeout=self.timeout)
+        return value
+
+    def invalidate(self, scope):
+        try:
+            cache.incr(self._generation_key(scope))
+        except ValueError:
+            # No generation yet: nothing has been cached under this scope.
+            pass
+
+
+chatted_users_cache = VersionedCache('chatted_users', timeout=60 * 15)
+typeahead_cache = VersionedCache('typeahead', timeout=30)
+group_members_cache = VersionedCache('group_members', timeout=60 * 60)
@@ -0,0 +1,127 @@
+from channels.exceptions import ChannelFull
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from asgiref.sync import sync_to_async
+from .models import User, Group
+from .realtime import user_group_name, chat_group_name
+from .ephemeral import SIGNAL_KINDS, SIGNAL_TTL, SignalThrottle
+from .fanout import take_pending
+from . import presence
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
+        session = self.scope.get('session')
+        self.user_id = await session.aget('user_id') if session is not None else None
+        if not self.user_id:
+            await self.close(code=4401)
+            return
+
+        # Loaded once so signals can name their sender without a query each.
+        names = await User.objects.filter(id=self.user_id).values_list('display_name', 'username').afirst()
+        self.display_name = (names[0] or names[1]) if names else ''
+        self.signals = SignalThrottle()
+        self.subscriptions = [user_group_name(self.user_id)]
+        async for group_id in Group.objects.filter(members__id=self.user_id).values_list('id', flat=True):
+            self.subscriptions.append(chat_group_name(group_id))
+        for name in self.subscriptions:
+            await self.channel_layer.group_add(name, self.channel_name)
+        await self.accept()
+        await sync_to_async(presence.heartbeat)(self.user_id)
+        # Messages sent while this user was offline left a marker instead of a push.
+        pending = await sync_to_async(take_pending)(self.user_id)
+        if pending is not None:
+            await self.send_json({'type': 'sync', 'message_id': pending})
+
+    async def disconnect(self, code):
+        if not getattr(self, 'subscriptions', None):
+            return
+        # Don't leave "typing..." showing until it times out.
+        for target in self.signals.drain():
+            await self.send_signal(target, 'stop')
+        for name in self.subscriptions:
+            await self.channel_layer.group_discard(name, self.channel_name)
+        await sync_to_async(presence.disconnect)(self.user_id)
+        presence.schedule_expiry(self.user_id)
+
+    async def receive_json(self, content, **kwargs):
+        if content.get('type') == 'ping':
+            # Pings double as presence heartbeats.
+            await sync_to_async(presence.heartbeat)(self.user_id)
+            await self.send_json({'type': 'pong'})
+        elif content.get('type') == 'signal':
+            await self.receive_signal(content)
+
+    async def receive_signal(self, content):
+        kind = content.get('kind')
+        if kind not in SIGNAL_KINDS:
+            return
+        try:
+            if content.get('group_id'):
+                group_id = int(content['group_id'])
+                target = (chat_group_name(group_id), group_id)
+                # Membership comes from this socket's own subscriptions, not the database.
+                if target[0] not in self.subscriptions:
+                    return
+            else:
+                recipient_id = int(content.get('recipient_id'))
+                if recipient_id == self.user_id:
+                    return
+                target = (user_group_name(recipient_id), None)
+        except (TypeError, ValueError):
+            return
+        if self.signals.allow(target, kind):
+            await self.send_signal(target, kind)
+
+    async def send_signal(self, target, kind):
+        name, group_id = target
+        try:
+            await self.channel_layer.group_send(name, {
+                'type': 'chat.signal',
+                'kind': kind,
+                'sender_id': self.user_id,
+                'sender_name': self.display_name,
+                'group_id': group_id,
+            })
+        except ChannelFull:
+            # Signals are disposable; a busy receiver simply misses one.
+            pass
+        except Exception as e:
+            logger.error(f"Error sending {kind} signal to {name}: {str(e)}")
+
+    async def message_new(self, event):
+        await self.send_json({'type': 'message.new', 'message': event['message']})
+
+    async def messages_seen(self, event):
+        await self.send_json({
+            'type': 'messages.seen',
+            'reader_id': event['reader_id'],
+            'message_ids': event['message_ids'],
+        })
+
+    async def chat_signal(self, event):
+        # A group send also reaches the sender's own sockets.
+        if event['sender_id'] == self.user_id:
+            return
+        await self.send_json({
+            'type': 'signal',
+            'kind': event['kind'],
+            'sender_id': event['sender_id'],
+            'sender_name': event['sender_name'],
+            'group_id': event['group_id'],
+            'ttl': SIGNAL_TTL,
+        })
+
+    async def presence_changed(self, event):
+        await self.send_json({'type': 'presence', 'user_id': event['user_id'], 'online': event['online']})
+
+    async def file_status(self, event):
+        await self.send_json({'type': 'file.status', 'file': event['file']})
+
+    async def group_joined(self, event):
+        name = chat_group_name(event['group_id'])
+        if name not in self.subscriptions:
+            self.subscriptions.append(name)
+            await self.channel_layer.group_add(name, self.channel_name)
@@ -0,0 +1,130 @@
+from django.db import models
+from django.utils import timezone
+from .cache import chatted_users_cache
+from .models import Message, Conversation
+
+PREVIEW_LENGTH = 100
+
+
+def conversation_messages(user_id, peer_id=None, group_id=None):
+    if group_id:
+        return Message.objects.filter(group_id=group_id)
+    return Message.objects.filter(
+        (models.Q(sender_id=user_id) & models.Q(recipient_id=peer_id)) |
+        (models.Q(sender_id=peer_id) & models.Q(recipient_id=user_id))
+    )
+
+
+def conversation_rows(message):
+    """Every participant's summary row for the conversation a message belongs to."""
+    if message.group_id:
+        return Conversation.objects.filter(group_id=message.group_id)
+    return Conversation.objects.filter(
+        (models.Q(user_id=message.sender_id) & models.Q(peer_id=message.recipient_id)) |
+        (models.Q(user_id=message.recipient_id) & models.Q(peer_id=message.sender_id))
+    )
+
+
+def summary_fields(message):
+    """Update expressions that move a row's last message forward to ``message``, never backwards."""
+    newer = models.Q(last_message_id__lt=message.id)
+    values = {
+        'last_message_id': message.id,
+        'last_message_at': message.timestamp,
+        'preview': message.content[:PREVIEW_LENGTH],
+    }
+    return {
+        field: models.Case(
+            models.When(newer, then=models.Value(value)),
+            default=models.F(field),
+            output_field=Conversation._meta.get_field(field),
+        )
+        for field, value in values.items()
+    }
+
+
+def record_message(message):
+    if not message.group_id and not message.recipient_id:
+        # Not part of any conversation, so there is no summary to update.
+        return
+    rows = conversation_rows(message)
+    if not message.group_id:
+        # The first DM between two users creates their contact rows; later ones only update them.
+        existing = set(rows.values_list('user_id', flat=True))
+        new_contacts = {message.sender_id: message.recipient_id, message.recipient_id: message.sender_id}
+        new_contacts = {user_id: peer_id for user_id, peer_id in new_contacts.items() if user_id not in existing}
+        if new_contacts:
+            Conversation.objects.bulk_create([
+                Conversation(user_id=user_id, peer_id=peer_id) for user_id, peer_id in new_contacts.items()
+            ], ignore_conflicts=True)
+            for user_id in new_contacts:
+                chatted_users_cache.invalidate(user_id)
+    rows.exclude(user_id=message.sender_id).update(
+        **summary_fields(message), unread_count=models.F('unread_count') + 1
+    )
+    rows.filter(user_id=message.sender_id).update(
+        **summary_fields(message), last_read_message_id=message.id, unread_count=0
+    )
+
+
+def record_edit(message):
+    conversation_rows(message).filter(last_message_id=message.id).update(preview=message.content[:PREVIEW_LENGTH])
+
+
+def record_delete(message):
+    """Call before deleting: drops the message from unread counts and rewinds rows that showed it."""
+    rows = conversation_rows(message)
+    rows.exclude(user_id=message.sender_id).filter(
+        last_read_message_id__lt=message.id, unread_count__gt=0
+    ).update(unread_count=models.F('unread_count') - 1)
+
+    previous = conversation_messages(message.sender_id, message.recipient_id, message.group_id).exclude(
+        id=message.id).order_by('-id').first()
+    rows.filter(last_message_id=message.id).update(
+        last_message_id=previous.id if previous else 0,
+        last_message_at=previous.timestamp if previous else None,
+        preview=previous.content[:PREVIEW_LENGTH] if previous else '',
+    )
+
+
+def join_group_conversation(user_id, group_id):
+    """Start a new member's summary at the group's current last message, with nothing unread."""
+    last_message = Message.objects.filter(group_id=group_id).order_by('-id').first()
+    defaults = {}
+    if last_message:
+        defaults = {
+            'last_read_message_id': last_message.id,
+            'last_message_id': last_message.id,
+            'last_message_at': last_message.timestamp,
+            'preview': last_message.content[:PREVIEW_LENGTH],
+        }
+    Conversation.objects.get_or_create(user_id=user_id, group_id=group_id, defaults=defaults)
+
+
+def advance_read_cursor(user_id, message_id, peer_id=None, group_id=None):
+    lookup = {'user_id': user_id, 'peer_id': peer_id, 'group_id': group_id}
+    if not Conversation.objects.filter(**lookup, last_read_message_id__lt=message_id).update(
+            last_read_message_id=message_id, unread_count=0):
+        Conversation.objects.get_or_create(**lookup, defaults={'last_read_message_id': message_id})
+
+
+def mark_read(user_id, peer_id=None, group_id=None):
+    """Stamp everything the user has not read in a conversation with set-based updates.
+
+    Returns the ids that were unread, so the senders can be told. Group
+    messages keep a single ``read_at`` (first reader) for the sender's ticks;
+    each member's own progress lives in their read cursor.
+    """
+    messages = conversation_messages(user_id, peer_id, group_id)
+    last_message_id = messages.order_by('-id').values_list('id', flat=True).first()
+    if not last_message_id:
+        return []
+
+    unread = messages.filter(id__lte=last_message_id, read_at__isnull=True).exclude(sender_id=user_id)
+    message_ids = list(unread.values_list('id', flat=True))
+    if message_ids:
+        now = timezone.now()
+        unread.filter(delivered_at__isnull=True).update(delivered_at=now)
+        unread.update(read_at=now)
+    advance_read_cursor(user_id, last_message_id, peer_id, group_id)
+    return message_ids
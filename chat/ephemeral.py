@@ -0,0 +1,65 @@
+import time
+
+# Typing-style signals only travel over the channel layer: nothing is
+# written and no member list is read, because a group send reaches exactly
+# the sockets currently subscribed to the group.
+SIGNAL_KINDS = ('typing', 'recording', 'stop')
+# A repeated typing/recording signal for the same chat is forwarded at most
+# this often; receivers keep showing it for SIGNAL_TTL seconds after the last one.
+SIGNAL_REPEAT_INTERVAL = 3
+SIGNAL_TTL = 6
+# Per connection: a burst of SIGNAL_BURST signals, refilled at SIGNAL_RATE per second.
+SIGNAL_BURST = 10
+SIGNAL_RATE = 2
+MAX_ACTIVE_TARGETS = 32
+
+
+class SignalThrottle:
+    """Rate limit and coalescing for one connection's signals, kept in the consumer itself.
+
+    Keystrokes arrive far more often than anyone needs to be told about them:
+    a signal that only repeats the last one for the same chat within
+    SIGNAL_REPEAT_INTERVAL is dropped, a ``stop`` is only sent if something
+    was started, and a token bucket caps whatever is left.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.tokens = SIGNAL_BURST
+        self.updated = clock()
+        self.active = {}
+
+    def _take(self, now):
+        self.tokens = min(SIGNAL_BURST, self.tokens + (now - self.updated) * SIGNAL_RATE)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def allow(self, target, kind):
+        """Whether ``kind`` for ``target`` (a channel-layer group name) should be forwarded now."""
+        now = self.clock()
+        current = self.active.get(target)
+        if kind == 'stop':
+            if current is None:
+                return False
+        elif current and current[0] == kind and now - current[1] < SIGNAL_REPEAT_INTERVAL:
+            return False
+        if not self._take(now):
+            # Receivers expire an unrefreshed indicator on their own.
+            return False
+        if kind == 'stop':
+            del self.active[target]
+        else:
+            self.active.pop(target, None)
+            self.active[target] = (kind, now)
+            if len(self.active) > MAX_ACTIVE_TARGETS:
+                del self.active[next(iter(self.active))]
+        return True
+
+    def drain(self):
+        """Targets still showing a signal from this connection, which should be told to stop."""
+        targets = list(self.active)
+        self.active.clear()
+        return targets
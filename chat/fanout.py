@@ -0,0 +1,151 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from .cache import group_members_cache
+from .models import Group
+from .presence import presence_key
+from .realtime import publish_message
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Members are checked for presence and marked in chunks, so a 10k-member
+# group costs twenty cache round trips rather than one huge request. Past
+# one chunk that work moves off the request onto a small thread pool.
+FANOUT_CHUNK_SIZE = 500
+FANOUT_WORKERS = 2
+# A member who was offline finds this on reconnect and refreshes their chat list. It
+# holds the first message they missed and is written once, not on every message.
+PENDING_TTL = 60 * 60 * 24 * 7
+FANOUT_SLOW_SECONDS = 0.5
+SIZE_BUCKETS = (10, 100, 1000, 10000)
+
+
+def pending_key(user_id):
+    return f'pending:{user_id}'
+
+
+def group_member_ids(group_id):
+    """Member ids of a group, read from the database once and then from the cache.
+
+    Good enough for delivery; access checks read membership from the database.
+    """
+    return group_members_cache.get_or_set(group_id, lambda: list(
+        Group.members.through.objects.filter(group_id=group_id).values_list('user_id', flat=True)
+    ))
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def take_pending(user_id):
+    """The first message id queued for the user while they were offline, clearing it."""
+    key = pending_key(user_id)
+    message_id = cache.get(key)
+    if message_id is not None:
+        cache.delete(key)
+    return message_id
+
+
+class FanoutMetrics:
+    """Recent fan-out durations in this process, grouped by audience size."""
+
+    def __init__(self, samples=1000):
+        self._lock = threading.Lock()
+        self._samples = {bucket: deque(maxlen=samples) for bucket in self.buckets()}
+        self._counts = dict.fromkeys(self._samples, 0)
+
+    @staticmethod
+    def buckets():
+        return [f'<={size}' for size in SIZE_BUCKETS] + [f'>{SIZE_BUCKETS[-1]}']
+
+    @staticmethod
+    def bucket(size):
+        for limit in SIZE_BUCKETS:
+            if size <= limit:
+                return f'<={limit}'
+        return f'>{SIZE_BUCKETS[-1]}'
+
+    def record(self, size, seconds):
+        bucket = self.bucket(size)
+        with self._lock:
+            self._samples[bucket].append(seconds)
+            self._counts[bucket] += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = {bucket: sorted(values) for bucket, values in self._samples.items()}
+            counts = dict(self._counts)
+        return {
+            bucket: {
+                'count': counts[bucket],
+                'p50_ms': round(values[len(values) // 2] * 1000, 3),
+                'p95_ms': round(values[min(len(values) - 1, len(values) * 95 // 100)] * 1000, 3),
+                'max_ms': round(values[-1] * 1000, 3),
+            }
+            for bucket, values in samples.items() if values
+        }
+
+
+metrics = FanoutMetrics()
+_marker_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+
+
+def fan_out(message_data):
+    """Deliver a serialized message to everyone in its conversation.
+
+    Connected members get it over their sockets: the conversation's
+    channel-layer group holds exactly the sockets that are open, so this is a
+    single send however large the group. Everyone else gets a pending marker
+    unless they already hold one, so their next connection knows to catch up.
+
+    Returns a Future while a large group's markers are still being written.
+    """
+    started = time.perf_counter()
+    sender_id = message_data['sender']['id']
+    if message_data.get('group'):
+        member_ids = group_member_ids(message_data['group']['id'])
+    elif message_data.get('recipient'):
+        member_ids = [sender_id, message_data['recipient']['id']]
+    else:
+        # Nothing but the sender's own sockets can see a message without a conversation.
+        member_ids = [sender_id]
+
+    publish_message(message_data)
+
+    recipients = [user_id for user_id in member_ids if user_id != sender_id]
+    if len(recipients) <= FANOUT_CHUNK_SIZE:
+        queue_markers(message_data['id'], recipients, len(member_ids), started)
+        return None
+    return _marker_executor.submit(queue_markers, message_data['id'], recipients, len(member_ids), started)
+
+
+def queue_markers(message_id, recipients, audience_size, started):
+    try:
+        queued = _queue_markers(message_id, recipients)
+    except Exception as e:
+        logger.error(f"Error queueing delivery markers for message {message_id}: {str(e)}")
+        return
+    elapsed = time.perf_counter() - started
+    metrics.record(audience_size, elapsed)
+    if elapsed > FANOUT_SLOW_SECONDS:
+        logger.warning(f"Slow fan-out for message {message_id}: {audience_size} members, "
+                       f"{queued} queued, {elapsed * 1000:.1f} ms")
+
+
+def _queue_markers(message_id, recipients):
+    queued = 0
+    for chunk in chunked(recipients, FANOUT_CHUNK_SIZE):
+        # Presence and existing markers come back in the same round trip.
+        keys = {presence_key(user_id): user_id for user_id in chunk}
+        keys.update({pending_key(user_id): user_id for user_id in chunk})
+        reached = {keys[key] for key in cache.get_many(list(keys))}
+        markers = {pending_key(user_id): message_id for user_id in chunk if user_id not in reached}
+        if markers:
+            cache.set_many(markers, timeout=PENDING_TTL)
+            queued += len(markers)
+    return queued
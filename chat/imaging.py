@@ -0,0 +1,71 @@
+from PIL import Image, ImageOps, features
+
+# Runs inside media worker processes: only plain filesystem paths go in and
+# out, so nothing here may touch Django models or settings.
+
+# Longest edge of each generated variant; "original" is only capped so a
+# panorama cannot produce a 100-megapixel re-encode.
+VARIANT_SIZES = {
+    'original': 4096,
+    'medium': 1280,
+    'thumbnail': 320,
+}
+FORMAT_EXTENSIONS = {
+    'AVIF': 'avif',
+    'WEBP': 'webp',
+    'JPEG': 'jpg',
+}
+SAVE_OPTIONS = {
+    'AVIF': {'quality': 55, 'speed': 8},
+    'WEBP': {'quality': 70, 'method': 4},
+    'JPEG': {'quality': 70, 'optimize': True, 'progressive': True},
+}
+
+
+def preferred_format():
+    """The most compact format this Pillow build can encode."""
+    for name, feature in (('AVIF', 'avif'), ('WEBP', 'webp')):
+        if features.check(feature):
+            return name
+    return 'JPEG'
+
+
+def make_variants(source_path, targets, image_format):
+    """Write the variants in ``targets`` ({name: path}); return {name: {'width', 'height', 'source'}}.
+
+    The source is decoded once, at reduced scale when the JPEG decoder can
+    skip detail no variant needs, and every smaller variant is produced from
+    the previous one with ``reduce`` before the final resample.
+    """
+    results = {}
+    with Image.open(source_path) as img:
+        largest = max(VARIANT_SIZES[name] for name in targets)
+        # For JPEG this decodes at 1/2, 1/4 or 1/8 scale; other formats ignore it.
+        img.draft('RGB', (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        mode = 'RGBA' if has_alpha and image_format != 'JPEG' else 'RGB'
+        img = img.convert(mode)
+
+        written = None
+        for name in sorted(targets, key=lambda variant: -VARIANT_SIZES[variant]):
+            scaled = scale_down(img, VARIANT_SIZES[name])
+            if written is None or scaled is not img:
+                scaled.save(targets[name], image_format, **SAVE_OPTIONS[image_format])
+                img, written = scaled, name
+            # A small image reuses the larger variant instead of writing an identical copy.
+            results[name] = {'width': img.width, 'height': img.height, 'source': written}
+    return results
+
+
+def scale_down(img, max_edge):
+    longest = max(img.size)
+    if longest <= max_edge:
+        return img
+    # Integer box reduction is cheap; the last step resamples to the exact size.
+    factor = longest // max_edge
+    if factor >= 2:
+        img = img.reduce(factor)
+    ratio = max_edge / max(img.size)
+    size = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+    return img.resize(size, Image.Resampling.LANCZOS) if size != img.size else img
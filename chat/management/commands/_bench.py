@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+from django.test.utils import setup_databases, teardown_databases
+
+
+@contextmanager
+def scratch_database(verbosity=0, keepdb=False):
+    """Run a benchmark against a throwaway test database instead of db.sqlite3."""
+    old_config = setup_databases(verbosity=verbosity, interactive=False, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=verbosity, keepdb=keepdb)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def format_ms(seconds):
+    return f'{seconds * 1000:.2f} ms'
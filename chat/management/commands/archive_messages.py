@@ -0,0 +1,40 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.utils import timezone
+from chat.archive import ARCHIVE_BATCH_SIZE, archive_batch
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Move messages older than MESSAGE_ARCHIVE_DAYS into the archive table, one short batch at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_ARCHIVE_DAYS)
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches so senders get the write lock')
+        parser.add_argument('--max-batches', type=int, default=0,
+                            help='Stop after this many batches; the next run carries on where this one stopped')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # An id cutoff keeps the archive a contiguous range below the hot table.
+        up_to_id = Message.objects.filter(timestamp__lt=cutoff).aggregate(last=models.Max('id'))['last']
+        if not up_to_id:
+            self.stdout.write('Nothing to archive')
+            return
+
+        moved = batches = 0
+        started = time.perf_counter()
+        while not options['max_batches'] or batches < options['max_batches']:
+            count = archive_batch(up_to_id, options['batch_size'])
+            if not count:
+                break
+            moved += count
+            batches += 1
+            time.sleep(options['pause'])
+        self.stdout.write(f'Archived {moved} messages in {batches} batches up to id {up_to_id} '
+                          f'({time.perf_counter() - started:.1f} s)')
@@ -0,0 +1,89 @@
+import random
+import time
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from chat.cache import group_members_cache
+from chat.fanout import fan_out, group_member_ids, metrics
+from chat.models import User, Group, Message
+from chat.presence import PRESENCE_TTL, presence_key
+from chat.realtime import chat_group_name, publish_message
+from chat.serializers import MESSAGE_ROW_FIELDS, serialize_messages
+from ._bench import scratch_database, percentile, format_ms
+
+
+class Command(BaseCommand):
+    help = 'Benchmark message fan-out for groups of different sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, nargs='+', default=[10, 1000, 10000])
+        parser.add_argument('--messages', type=int, default=50)
+        parser.add_argument('--online', type=float, default=0.1, help='Share of members with an open socket')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with scratch_database():
+            for count in options['members']:
+                self.run(count, options, rng)
+        self.stdout.write('fan-out metrics (until every member is pushed to or marked):')
+        for bucket, stats in metrics.snapshot().items():
+            self.stdout.write(f'  {bucket}: {stats}')
+
+    def run(self, count, options, rng):
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'fan_{count}_{i}', display_name=f'fan {i}', password='!') for i in range(count)
+            ])
+            group = Group.objects.create(name=f'fan_{count}', creator=users[0])
+            Group.members.through.objects.bulk_create([
+                Group.members.through(group_id=group.id, user_id=user.id) for user in users
+            ], batch_size=5000)
+
+        # Connected members: a presence key and a channel in the group, as an open socket would have.
+        connected = rng.sample(users, max(1, int(count * options['online'])))
+        cache.set_many({presence_key(user.id): time.time() for user in connected}, timeout=PRESENCE_TTL)
+        layer = get_channel_layer()
+        for user in connected:
+            async_to_sync(layer.group_add)(chat_group_name(group.id), f'bench.{user.id}')
+
+        message = Message.objects.create(sender=users[0], group=group, content='fan-out')
+        message_data = serialize_messages(Message.objects.filter(id=message.id).values(*MESSAGE_ROW_FIELDS))[0]
+
+        def timed(func):
+            timings = []
+            for _ in range(options['messages']):
+                started = time.perf_counter()
+                pending = func()
+                timings.append(time.perf_counter() - started)
+                if pending is not None:
+                    pending.result()
+                # The in-memory layer keeps undelivered events; drop them between sends.
+                if hasattr(layer, 'flush'):
+                    async_to_sync(layer.flush)()
+                    for user in connected:
+                        async_to_sync(layer.group_add)(chat_group_name(group.id), f'bench.{user.id}')
+            return timings
+
+        def legacy():
+            # What a send cost before: a membership join per message, then one group push.
+            Group.objects.filter(id=group.id, members__id=users[0].id).exists()
+            publish_message(message_data)
+
+        def cold():
+            group_members_cache.invalidate(group.id)
+            users[0].id in group_member_ids(group.id)
+            return fan_out(message_data)
+
+        def warm():
+            users[0].id in group_member_ids(group.id)
+            return fan_out(message_data)
+
+        # Request time; the metrics printed at the end include markers written in the background.
+        self.stdout.write(f'members={count} connected={len(connected)}')
+        for name, func in (('legacy push only', legacy), ('fan-out, cold member set', cold),
+                           ('fan-out, cached member set', warm)):
+            timings = timed(func)
+            self.stdout.write(f'  {name}: p50={format_ms(percentile(timings, 50))} '
+                              f'p95={format_ms(percentile(timings, 95))} max={format_ms(max(timings))}')
@@ -0,0 +1,97 @@
+import time
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.utils import timezone
+from chat.models import User, Group, Message
+from chat.serializers import MessageSerializer
+from ._bench import scratch_database, percentile, format_ms
+
+
+class Command(BaseCommand):
+    help = 'Benchmark keyset-paginated message history on a seeded database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1_000_000)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--legacy', action='store_true',
+                            help='Also time the old unbounded "last_message_id=0" load of one group')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            users, groups = self.seed(options)
+            session = SessionStore()
+            session['user_id'] = users[0].id
+            session.create()
+            client = Client()
+            client.cookies['sessionid'] = session.session_key
+
+            group = groups[0]
+            ids = list(Message.objects.filter(group=group).order_by('id').values_list('id', flat=True))
+            middle, newest = ids[len(ids) // 2], ids[-1]
+            self.stdout.write(f'{Message.objects.count()} messages, {len(ids)} in the benchmarked group')
+
+            scenarios = [
+                ('newest page', {'group_id': group.id}),
+                ('scroll back from middle', {'group_id': group.id, 'before': middle}),
+                ('catch up', {'group_id': group.id, 'after': newest - 1000}),
+                ('direct messages newest page', {'recipient_id': users[1].id}),
+                ('all conversations catch up', {'after': newest - 1000}),
+            ]
+            for label, params in scenarios:
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    response = client.get('/api/messages/', params)
+                    timings.append(time.perf_counter() - started)
+                rows = len(response.json())
+                self.stdout.write(f'{label}: rows={rows} p50={format_ms(percentile(timings, 50))} '
+                                  f'p95={format_ms(percentile(timings, 95))}')
+
+            plan = Message.objects.filter(group_id=group.id, id__lt=middle).order_by('-id')[:50].explain()
+            self.stdout.write(f'plan (group, before): {plan}')
+
+            if options['legacy']:
+                started = time.perf_counter()
+                legacy = Message.objects.filter(id__gt=0, group_id=group.id).select_related(
+                    'sender', 'recipient', 'group').prefetch_related('files').order_by('timestamp')
+                data = MessageSerializer(legacy, many=True).data
+                self.stdout.write(f'legacy unbounded load: rows={len(data)} '
+                                  f'{format_ms(time.perf_counter() - started)}')
+
+    def seed(self, options):
+        users = User.objects.bulk_create([
+            User(username=f'history_{i}', display_name=f'history {i}', password='!') for i in range(options['users'])
+        ])
+        groups = [Group.objects.create(name=f'history_{i}', creator=users[0]) for i in range(options['groups'])]
+        for group in groups:
+            group.members.add(*users)
+
+        table = Message._meta.db_table
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        sql = (f'INSERT INTO {table} (sender_id, recipient_id, group_id, content, timestamp, delivered_at, read_at) '
+               f'VALUES (%s, %s, %s, %s, %s, %s, NULL)')
+        batch = []
+        for i in range(options['messages']):
+            sender = users[i % len(users)].id
+            if i % 5:
+                row = (sender, None, groups[(i // 5) % len(groups)].id, f'message {i}', now, now)
+            else:
+                row = (sender, users[(i + 1) % len(users)].id, None, f'message {i}', now, now)
+            batch.append(row)
+            if len(batch) == 50_000:
+                self.insert(sql, batch)
+                batch = []
+        if batch:
+            self.insert(sql, batch)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+        return users, groups
+
+    def insert(self, sql, rows):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
@@ -0,0 +1,82 @@
+import asyncio
+import importlib.util
+import time
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from chat.models import User
+from ._bench import scratch_database, percentile, format_ms
+
+HASHERS = {
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+}
+
+
+class Command(BaseCommand):
+    help = 'Login throughput per core for each password hasher, and how a burst of logins delays other requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=50, help='Concurrent logins in the burst')
+        parser.add_argument('--hashers', nargs='+', default=list(HASHERS), choices=list(HASHERS))
+
+    def handle(self, *args, **options):
+        workers = settings.PASSWORD_HASH_WORKERS
+        self.stdout.write(f'hashing pool: {workers} threads')
+        with scratch_database():
+            for name in options['hashers']:
+                if name == 'argon2' and not importlib.util.find_spec('argon2'):
+                    self.stdout.write(f'{name}: skipped, argon2-cffi is not installed')
+                    continue
+                with override_settings(PASSWORD_HASHERS=[HASHERS[name]]):
+                    cache.clear()
+                    self.run(name, options['logins'], workers)
+
+    def run(self, name, count, workers):
+        encoded = make_password('pw12345')
+        # Every account shares one hash; creating them shouldn't cost a hash each.
+        User.objects.bulk_create([
+            User(username=f'{name}_{i}', display_name=f'{name} {i}', password=encoded) for i in range(count)
+        ])
+
+        started = time.perf_counter()
+        for _ in range(5):
+            check_password('pw12345', encoded)
+        per_hash = (time.perf_counter() - started) / 5
+
+        burst, latencies = asyncio.run(self.burst(name, count))
+        self.stdout.write(
+            f'{name}: {format_ms(per_hash)}/hash, {1 / per_hash:.1f} logins/s/core on one thread; '
+            f'burst of {count}: {count / burst:.1f} logins/s ({count / burst / workers:.1f}/core), '
+            f'other requests meanwhile p50={format_ms(percentile(latencies, 50))} '
+            f'p95={format_ms(percentile(latencies, 95))}'
+        )
+
+    async def burst(self, name, count):
+        async def log_in(i):
+            response = await AsyncClient().post('/api/users/', {'username': f'{name}_{i}', 'password': 'pw12345'},
+                                                content_type='application/json')
+            assert response.status_code == 200, response.content
+
+        latencies = []
+        done = asyncio.Event()
+
+        async def poll():
+            # A cheap request that shouldn't have to wait for the hashing.
+            client = AsyncClient()
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get('/api/users/current/')
+                latencies.append(time.perf_counter() - started)
+
+        poller = asyncio.create_task(poll())
+        started = time.perf_counter()
+        await asyncio.gather(*(log_in(i) for i in range(count)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await poller
+        return elapsed, latencies
@@ -0,0 +1,62 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from chat.models import User, Group, Message, File
+from chat.serializers import MessageSerializer, MESSAGE_ROW_FIELDS, serialize_messages
+from ._bench import scratch_database, format_ms
+
+
+class Command(BaseCommand):
+    help = 'Compare MessageSerializer with the flat serialize_messages fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        with scratch_database():
+            users = User.objects.bulk_create([
+                User(username=f'bench_{i}', display_name=f'bench {i}', password='!',
+                     profile_image='profiles/ICON_PROF.jpg' if i % 2 else None)
+                for i in range(options['users'])
+            ])
+            group = Group.objects.create(name='bench', creator=users[0])
+            group.members.add(*users)
+
+            for size in options['sizes']:
+                Message.objects.all().delete()
+                messages = Message.objects.bulk_create([
+                    Message(sender=users[i % len(users)], group=group if i % 3 else None,
+                            recipient=None if i % 3 else users[(i + 1) % len(users)], content=f'message {i}')
+                    for i in range(size)
+                ])
+                File.objects.bulk_create([
+                    File(file=f'uploads/bench_{message.id}.jpg', file_type='image', message=message)
+                    for message in messages[::4]
+                ])
+
+                def legacy():
+                    queryset = Message.objects.select_related('sender', 'recipient', 'group').prefetch_related(
+                        'files').order_by('id')
+                    return renderer.render(MessageSerializer(queryset, many=True).data)
+
+                def fast():
+                    rows = Message.objects.order_by('id').values(*MESSAGE_ROW_FIELDS)
+                    return renderer.render(serialize_messages(rows))
+
+                if legacy() != fast():
+                    raise CommandError(f'Output differs at {size} messages')
+                legacy_time = self.best(legacy, options['repeat'])
+                fast_time = self.best(fast, options['repeat'])
+                self.stdout.write(f'{size} messages: MessageSerializer={format_ms(legacy_time)} '
+                                  f'serialize_messages={format_ms(fast_time)} speedup={legacy_time / fast_time:.1f}x')
+
+    def best(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
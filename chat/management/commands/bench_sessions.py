@@ -0,0 +1,50 @@
+import time
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from chat.models import User, Group, Message
+from ._bench import scratch_database, percentile, format_ms
+
+ENGINES = ['db', 'cached_db', 'signed_cookies']
+
+
+class Command(BaseCommand):
+    help = 'Per-request overhead of an idle /api/messages/ poll for each session engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            user = User(username='poller', display_name='poller')
+            user.set_password('pw12345')
+            user.save()
+            group = Group.objects.create(name='poll', creator=user)
+            group.members.add(user)
+            Message.objects.bulk_create([Message(sender=user, group=group, content=f'm{i}') for i in range(50)])
+            last_id = Message.objects.order_by('-id').values_list('id', flat=True).first()
+
+            for engine in options['engines']:
+                with override_settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+                    cache.clear()
+                    self.run(engine, group, last_id, options['requests'])
+
+    def run(self, engine, group, last_id, count):
+        client = Client()
+        client.post('/api/users/', {'username': 'poller', 'password': 'pw12345'}, content_type='application/json')
+        params = {'group_id': group.id, 'last_message_id': last_id}
+        client.get('/api/messages/', params)
+
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(count):
+                started = time.perf_counter()
+                response = client.get('/api/messages/', params)
+                timings.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.content
+        session_queries = sum('django_session' in query['sql'] for query in queries.captured_queries)
+        self.stdout.write(f'{engine}: p50={format_ms(percentile(timings, 50))} p95={format_ms(percentile(timings, 95))} '
+                          f'queries/request={len(queries) / count:.2f} (session {session_queries / count:.2f})')
@@ -0,0 +1,63 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from chat.cache import typeahead_cache
+from chat.models import User, SearchTerm
+from chat.search import name_terms, typeahead
+from ._bench import scratch_database, percentile, format_ms
+
+FIRST_NAMES = ['ali', 'amir', 'mahdi', 'reza', 'sara', 'zahra', 'maryam', 'hossein', 'fatemeh', 'mohammad',
+               'علی', 'امیر', 'مهدی', 'رضا', 'سارا', 'زهرا', 'مریم', 'حسین', 'فاطمه', 'محمد']
+LAST_NAMES = ['ahmadi', 'karimi', 'rezaei', 'hosseini', 'moradi', 'احمدی', 'کریمی', 'رضایی', 'حسینی', 'مرادی']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark typeahead user search against the old unbounded icontains scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--legacy', action='store_true', help='Also time username__icontains')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with scratch_database():
+            self.seed(options['users'], rng)
+            self.stdout.write(f'{User.objects.count()} users, {SearchTerm.objects.count()} search terms')
+
+            queries = [name[:length] for name in FIRST_NAMES + LAST_NAMES for length in (1, 2, 3)]
+            timings = []
+            for _ in range(options['repeat']):
+                query = rng.choice(queries)
+                # Measure the index, not the result cache.
+                typeahead_cache.invalidate('user')
+                started = time.perf_counter()
+                typeahead('user', query)
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(f'typeahead: p50={format_ms(percentile(timings, 50))} '
+                              f'p95={format_ms(percentile(timings, 95))} max={format_ms(max(timings))}')
+
+            if options['legacy']:
+                timings = []
+                for query in queries[:10]:
+                    started = time.perf_counter()
+                    list(User.objects.filter(username__icontains=query).values_list('id', flat=True))
+                    timings.append(time.perf_counter() - started)
+                self.stdout.write(f'legacy icontains: p50={format_ms(percentile(timings, 50))} '
+                                  f'max={format_ms(max(timings))}')
+
+    def seed(self, count, rng):
+        batch_size = 10_000
+        for start in range(0, count, batch_size):
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(username=f'{rng.choice(FIRST_NAMES)}_{i}', password='!',
+                         display_name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}')
+                    for i in range(start, min(start + batch_size, count))
+                ])
+                SearchTerm.objects.bulk_create([
+                    SearchTerm(kind='user', rank=rank, term=term, user_id=user.id)
+                    for user in users
+                    for rank, term in name_terms(user.username, user.display_name)
+                ])
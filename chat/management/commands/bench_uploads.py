@@ -0,0 +1,82 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from PIL import Image
+from chat.models import User, File
+from ._bench import scratch_database, percentile, format_ms
+
+
+class Command(BaseCommand):
+    help = 'Upload latency under concurrent image uploads, compressing inline versus in the media queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uploads', type=int, default=16)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--width', type=int, default=4000)
+        parser.add_argument('--height', type=int, default=3000)
+        parser.add_argument('--modes', nargs='+', default=['inline', 'process'], choices=['inline', 'process'])
+
+    def handle(self, *args, **options):
+        noise = Image.effect_noise((options['width'], options['height']), 64).convert('RGB')
+        # Every upload gets its own bytes: identical payloads would be stored once and compressed once.
+        payloads = [self.variant(noise, index) for index in range(options['uploads'] * len(options['modes']))]
+        size = sum(map(len, payloads)) / len(payloads)
+        self.stdout.write(f'{options["uploads"]} uploads of a {size / (1024 * 1024):.1f} MB '
+                          f'{options["width"]}x{options["height"]} JPEG, {options["concurrency"]} at a time')
+
+        scratch = tempfile.mkdtemp()
+        try:
+            if connection.vendor == 'sqlite':
+                # A file, not the in-memory test database, whose shared-cache table locks fail at once under threads.
+                connection.settings_dict['TEST']['NAME'] = os.path.join(scratch, 'bench.sqlite3')
+            with scratch_database(), override_settings(MEDIA_ROOT=os.path.join(scratch, 'media')):
+                session = SessionStore()
+                session['user_id'] = User.objects.create(username='bench_upload', password='!').id
+                session.create()
+                for number, mode in enumerate(options['modes']):
+                    batch = payloads[number * options['uploads']:(number + 1) * options['uploads']]
+                    with override_settings(MEDIA_QUEUE=mode):
+                        self.run(mode, batch, session.session_key, options)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def variant(self, noise, index):
+        image = noise.copy()
+        image.paste((index % 256, index // 256 % 256, 255), (0, 0, 64, 64))
+        encoded = io.BytesIO()
+        image.save(encoded, 'JPEG', quality=95)
+        return encoded.getvalue()
+
+    def run(self, mode, payloads, session_key, options):
+        def upload(index):
+            client = Client()
+            client.cookies['sessionid'] = session_key
+            file = io.BytesIO(payloads[index])
+            file.name = f'photo_{index}.jpg'
+            started = time.perf_counter()
+            response = client.post('/api/upload/', {'files': file})
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f'{file.name}: HTTP {response.status_code} {response.content[:200]!r}')
+            return elapsed, response.json()['file_ids'][0]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(upload, range(len(payloads))))
+        accepted = time.perf_counter() - started
+        file_ids = [file_id for _, file_id in results]
+        while File.objects.filter(id__in=file_ids, status='processing').exists():
+            time.sleep(0.05)
+        drained = time.perf_counter() - started
+
+        latencies = [elapsed for elapsed, _ in results]
+        self.stdout.write(f'{mode}: p50={format_ms(percentile(latencies, 50))} '
+                          f'p95={format_ms(percentile(latencies, 95))} all accepted in {accepted:.2f} s, '
+                          f'all compressed in {drained:.2f} s')
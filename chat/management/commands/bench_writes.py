@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from chat.models import User, Group
+from ._bench import scratch_database, percentile, format_ms
+
+# Each mode runs in its own process, since the database settings are read from the environment at startup.
+MODES = {
+    'sqlite': {'SQLITE_TUNING': '0'},
+    'sqlite-wal': {'SQLITE_TUNING': '1'},
+    'postgres': {'DB_POOL_MAX_SIZE': '0'},
+    'postgres-pool': {'DB_POOL_MAX_SIZE': '20'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Concurrent message sends against each database configuration'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--messages', type=int, default=50, help='Messages per writer')
+        parser.add_argument('--modes', nargs='+', choices=list(MODES),
+                            help='Defaults to both SQLite modes, plus PostgreSQL when POSTGRES_DB is set')
+        parser.add_argument('--run', choices=list(MODES), help=False)
+
+    def handle(self, *args, **options):
+        if options['run']:
+            return self.run(options['run'], options['writers'], options['messages'])
+
+        modes = options['modes'] or [mode for mode in MODES
+                                     if mode.startswith('sqlite') or os.environ.get('POSTGRES_DB')]
+        for mode in modes:
+            if mode.startswith('postgres') and not os.environ.get('POSTGRES_DB'):
+                self.stdout.write(f'{mode}: skipped, set POSTGRES_DB (and POSTGRES_HOST/USER/PASSWORD) to a local server')
+                continue
+            env = dict(os.environ, **MODES[mode])
+            if mode.startswith('sqlite'):
+                env.pop('POSTGRES_DB', None)
+            result = subprocess.run(
+                [sys.executable, sys.argv[0], 'bench_writes', '--run', mode,
+                 '--writers', str(options['writers']), '--messages', str(options['messages'])],
+                env=env, capture_output=True, text=True,
+            )
+            output = result.stdout.strip() or result.stderr.strip().splitlines()[-1]
+            self.stdout.write(output)
+
+    def run(self, mode, writers, count):
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # A file, not the in-memory test database, so locking behaves as in production.
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            with scratch_database():
+                self.measure(mode, writers, count)
+
+    def measure(self, mode, writers, count):
+        users = [User.objects.create(username=f'writer{i}', password='pw12345') for i in range(writers)]
+        group = Group.objects.create(name='writes', creator=users[0])
+        group.members.add(*users)
+
+        timings = []
+        failures = []
+        lock = threading.Lock()
+        ready = threading.Barrier(writers)
+
+        def write(user):
+            client = Client()
+            client.post('/api/users/', {'username': user.username, 'password': 'pw12345'},
+                        content_type='application/json')
+            ready.wait()
+            try:
+                for i in range(count):
+                    started = time.perf_counter()
+                    try:
+                        response = client.post('/api/messages/', {'group_id': group.id, 'content': f'{user.id}-{i}'},
+                                               content_type='application/json')
+                        ok = response.status_code == 200
+                    except Exception as e:
+                        ok = False
+                        error = str(e)
+                    else:
+                        error = response.status_code
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        timings.append(elapsed)
+                        if not ok:
+                            failures.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=write, args=(user,)) for user in users]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        detail = ''
+        if failures:
+            detail = f' (e.g. {failures[0]})'
+        pool = settings.DATABASES['default'].get('OPTIONS', {}).get('pool')
+        self.stdout.write(
+            f'{mode}: {writers} writers x {count} messages, {len(timings) / elapsed:.0f} sends/s, '
+            f'p50={format_ms(percentile(timings, 50))} p95={format_ms(percentile(timings, 95))} '
+            f'max={format_ms(max(timings))}, failed={len(failures)}{detail}'
+            + (f', pool max_size={pool["max_size"]}' if pool else '')
+        )
@@ -0,0 +1,23 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chat.models import UploadSession
+from chat.uploads import abort_upload
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable uploads that were never committed, along with their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Idle time before an upload is abandoned')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        stale = UploadSession.objects.filter(file__isnull=True, updated_at__lt=cutoff)
+        count = 0
+        for upload in stale.iterator():
+            abort_upload(upload)
+            count += 1
+        # Committed sessions are only needed to answer a repeated commit.
+        UploadSession.objects.filter(file__isnull=False, updated_at__lt=cutoff).delete()
+        self.stdout.write(f'Removed {count} abandoned uploads')
@@ -0,0 +1,28 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.utils import timezone
+from chat.blobs import delete_blob
+from chat.models import Blob
+
+
+class Command(BaseCommand):
+    help = 'Recount blob references from File rows and delete blobs nothing points to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=60,
+                            help='Minutes a blob must exist before it can be collected, so in-flight uploads survive')
+
+    def handle(self, *args, **options):
+        # A worker that dies between a File change and its refcount update leaves the count off.
+        drifted = Blob.objects.annotate(references=models.Count('files')).exclude(refcount=models.F('references'))
+        fixed = 0
+        for blob in drifted.iterator():
+            Blob.objects.filter(id=blob.id).update(refcount=blob.references)
+            fixed += 1
+
+        cutoff = timezone.now() - timedelta(minutes=options['min_age'])
+        removed = 0
+        for blob in Blob.objects.filter(refcount=0, files__isnull=True, created_at__lt=cutoff).iterator():
+            removed += delete_blob(blob.id)
+        self.stdout.write(f'Fixed {fixed} reference counts, removed {removed} unreferenced blobs')
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+from django.test import Client
+from chat.models import User, Group
+from ._bench import scratch_database, percentile, format_ms
+
+
+class Command(BaseCommand):
+    help = 'Compare WebSocket push delivery with interval polling for N connected users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000])
+        parser.add_argument('--messages', type=int, default=20)
+        parser.add_argument('--poll-interval', type=float, default=5.0)
+        parser.add_argument('--poll-samples', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            for count in options['users']:
+                self.run(count, options)
+
+    def run(self, count, options):
+        users = User.objects.bulk_create([
+            User(username=f'load_{count}_{i}', display_name=f'load {i}', password='!') for i in range(count)
+        ])
+        group = Group.objects.create(name=f'load_{count}', creator=users[0])
+        group.members.add(*users)
+
+        session_keys = []
+        for user in users:
+            session = SessionStore()
+            session['user_id'] = user.id
+            session.create()
+            session_keys.append(session.session_key)
+
+        client = Client()
+        client.cookies['sessionid'] = session_keys[0]
+        client.post('/api/messages/', {'group_id': group.id, 'content': 'warmup'}, content_type='application/json')
+        last_id = client.get('/api/messages/', {'group_id': group.id}).json()[-1]['id']
+
+        # What one idle client costs today: an empty poll every interval.
+        started = time.perf_counter()
+        for _ in range(options['poll_samples']):
+            client.get('/api/messages/', {'group_id': group.id, 'last_message_id': last_id})
+        poll_cost = (time.perf_counter() - started) / options['poll_samples']
+
+        latencies = asyncio.run(self.push(client, group, session_keys, options['messages']))
+
+        polls_per_second = count / options['poll_interval']
+        self.stdout.write(f'users={count}')
+        self.stdout.write(f'  polling: {polls_per_second:.1f} req/s removed, {format_ms(poll_cost)} per idle poll, '
+                          f'{polls_per_second * poll_cost:.3f} worker-seconds/s saved, '
+                          f'{format_ms(options["poll_interval"] / 2)} average delivery delay')
+        self.stdout.write(f'  push: p50={format_ms(percentile(latencies, 50))} p95={format_ms(percentile(latencies, 95))} '
+                          f'max={format_ms(max(latencies))} over {len(latencies)} deliveries')
+
+    async def push(self, client, group, session_keys, messages):
+        from chat_project.asgi import application
+
+        sockets = []
+        for key in session_keys:
+            socket = ApplicationCommunicator(application, {
+                'type': 'websocket',
+                'path': '/ws/chat/',
+                'headers': [(b'cookie', f'sessionid={key}'.encode())],
+                'query_string': b'',
+                'subprotocols': [],
+            })
+            await socket.send_input({'type': 'websocket.connect'})
+            accepted = await socket.receive_output(timeout=10)
+            assert accepted['type'] == 'websocket.accept', accepted
+            sockets.append(socket)
+
+        async def arrival(socket):
+            await socket.receive_output(timeout=30)
+            return time.perf_counter()
+
+        post = sync_to_async(client.post)
+        latencies = []
+        for i in range(messages):
+            receivers = [asyncio.create_task(arrival(socket)) for socket in sockets]
+            started = time.perf_counter()
+            await post('/api/messages/', {'group_id': group.id, 'content': f'push {i}'}, content_type='application/json')
+            latencies.extend(arrived - started for arrived in await asyncio.gather(*receivers))
+
+        for socket in sockets:
+            await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await socket.wait(timeout=10)
+        return latencies
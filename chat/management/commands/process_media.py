@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from chat.models import File
+from chat.tasks import MEDIA_QUEUE_KEY, process_file, redis_client
+
+
+class Command(BaseCommand):
+    help = 'Process uploaded media from the Redis queue (MEDIA_QUEUE=redis) or catch up on stuck files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requeue', action='store_true',
+                            help='First process every file still marked processing, e.g. after a crash')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            for file_id in File.objects.filter(status='processing').values_list('id', flat=True):
+                process_file(file_id)
+        if settings.MEDIA_QUEUE != 'redis':
+            if not options['requeue']:
+                self.stderr.write('MEDIA_QUEUE is not "redis"; uploads are processed by the server itself')
+            return
+
+        client = redis_client()
+        self.stdout.write(f'Waiting for media jobs on {MEDIA_QUEUE_KEY}')
+        while True:
+            item = client.brpop(MEDIA_QUEUE_KEY, timeout=5)
+            if item is None:
+                if options['once']:
+                    return
+                continue
+            close_old_connections()
+            process_file(int(item[1]))
@@ -0,0 +1,157 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse, Http404
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+import django.db.models as models
+from .models import File, Group
+import mimetypes
+import os
+import re
+
+STREAM_BLOCK_SIZE = 256 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+VARIANT_RE = re.compile(r'^(?P<stem>.+)_(?:thumbnail|medium|original)\.(?P<extension>\w+)$')
+BLOB_RE = re.compile(r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/(?P<sha256>[0-9a-f]{64})')
+# Attachments are checked against the conversation; everything else (avatars, group images) is public.
+PROTECTED_PREFIXES = ('uploads/', 'blobs/')
+
+
+def can_access(user_id, name):
+    """Whether the user may read a stored name: they uploaded it or can see a message it is attached to."""
+    if not user_id:
+        return False
+    blob = BLOB_RE.match(name)
+    if blob:
+        files = File.objects.filter(blob__sha256=blob.group('sha256'))
+    else:
+        variant = VARIANT_RE.match(name)
+        names = [name]
+        if variant:
+            names.append(f"{variant.group('stem')}_original.{variant.group('extension')}")
+        files = File.objects.filter(file__in=names)
+    return files.filter(
+        models.Q(uploader_id=user_id) |
+        models.Q(message__sender_id=user_id) |
+        models.Q(message__recipient_id=user_id) |
+        models.Q(message__group_id__in=Group.objects.filter(members__id=user_id).values('id')) |
+        models.Q(archived_message__sender_id=user_id) |
+        models.Q(archived_message__recipient_id=user_id) |
+        models.Q(archived_message__group_id__in=Group.objects.filter(members__id=user_id).values('id'))
+    ).exists()
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single ``bytes=`` range, None to send everything, or False if unsatisfiable."""
+    match = RANGE_RE.match(header or '')
+    if not match or not any(match.groups()):
+        # Multiple ranges and other units are legal to ignore: answer with the whole file.
+        return None
+    first, last = match.groups()
+    if not first:
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def read_blocks(path, start, length):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            block = source.read(min(STREAM_BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+async def aread_blocks(path, start, length):
+    # Under ASGI a sync iterator would be read into memory in full before sending.
+    blocks = read_blocks(path, start, length)
+    read = sync_to_async(next, thread_sensitive=False)
+    while True:
+        block = await read(blocks, None)
+        if block is None:
+            return
+        yield block
+
+
+def media_etag(name, stat):
+    blob = BLOB_RE.match(name)
+    if blob:
+        # Content-addressed: the digest (plus variant suffix) never changes for this name.
+        return f'"{os.path.basename(name)}"'
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+@require_safe
+def serve_media(request, path):
+    name = os.path.normpath(path).replace('\\', '/')
+    if name.startswith(('../', '/')) or name == '..':
+        raise Http404
+    protected = name.startswith(PROTECTED_PREFIXES)
+    if protected and not can_access(request.session.get('user_id'), name):
+        # 404 rather than 403 so file names cannot be probed.
+        raise Http404
+
+    full_path = default_storage.path(name)
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = media_etag(name, stat)
+    content_type = mimetypes.guess_type(name)[0]
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': (
+            'private, max-age=31536000, immutable' if name.startswith('blobs/')
+            else 'private, no-cache' if protected else 'public, max-age=3600'
+        ),
+    }
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        return HttpResponseNotModified(headers=headers)
+
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    if mode:
+        # The front server reads the file and handles Range itself.
+        response = HttpResponse(content_type=content_type or 'application/octet-stream', headers=headers)
+        if mode == 'x-accel':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + name
+        else:
+            response['X-Sendfile'] = full_path
+        return response
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if not if_range or if_range == etag:
+        byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+    if byte_range is False:
+        return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{stat.st_size}'})
+    start, end = byte_range or (0, stat.st_size - 1)
+    length = end - start + 1 if stat.st_size else 0
+
+    blocks = aread_blocks if isinstance(request, ASGIRequest) else read_blocks
+    response = StreamingHttpResponse(
+        blocks(full_path, start, length) if request.method == 'GET' else [],
+        status=206 if byte_range else 200,
+        content_type=content_type or 'application/octet-stream',
+        headers=headers,
+    )
+    response['Content-Length'] = str(length)
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    return response
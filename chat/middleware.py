@@ -0,0 +1,41 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject
+from .models import User
+
+
+def get_chat_user(request):
+    if not hasattr(request, '_cached_chat_user'):
+        user_id = request.session.get('user_id')
+        request._cached_chat_user = User.objects.filter(id=user_id).first() if user_id else None
+    return request._cached_chat_user
+
+
+class ChatUserMiddleware:
+    """Expose the logged-in chat user as ``request.chat_user``.
+
+    The row is loaded on first access and shared by everything that handles
+    the request afterwards; requests that only need the id from the session
+    never touch the users table. The lazy object is falsy when nobody is
+    logged in, so test it with ``if not request.chat_user``, not ``is None``.
+
+    Setting the attribute does no I/O, so the middleware runs in whichever
+    mode the stack around it does and async views don't pay a thread hop for it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request.chat_user = SimpleLazyObject(lambda: get_chat_user(request))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.chat_user = SimpleLazyObject(lambda: get_chat_user(request))
+        return await self.get_response(request)
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_user_description_file_chat_file_file_ty_72678a_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["group", "id"], name="chat_messag_group_i_849dbb_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["sender", "recipient", "id"],
+                name="chat_messag_sender__92a67e_idx",
+            ),
+        ),
+    ]
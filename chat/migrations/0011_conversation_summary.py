@@ -0,0 +1,86 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+def backfill_conversations(apps, schema_editor):
+    Conversation = apps.get_model("chat", "Conversation")
+    Group = apps.get_model("chat", "Group")
+    Message = apps.get_model("chat", "Message")
+
+    for membership in Group.members.through.objects.all().iterator():
+        Conversation.objects.get_or_create(
+            user_id=membership.user_id, group_id=membership.group_id
+        )
+    pairs = (
+        Message.objects.filter(recipient__isnull=False)
+        .values_list("sender_id", "recipient_id")
+        .distinct()
+    )
+    for sender_id, recipient_id in pairs:
+        Conversation.objects.get_or_create(user_id=sender_id, peer_id=recipient_id)
+        Conversation.objects.get_or_create(user_id=recipient_id, peer_id=sender_id)
+
+    for conversation in Conversation.objects.all().iterator():
+        if conversation.group_id:
+            messages = Message.objects.filter(group_id=conversation.group_id)
+        else:
+            messages = Message.objects.filter(
+                models.Q(
+                    sender_id=conversation.user_id, recipient_id=conversation.peer_id
+                )
+                | models.Q(
+                    sender_id=conversation.peer_id, recipient_id=conversation.user_id
+                )
+            )
+        last_message = messages.order_by("-id").first()
+        if last_message:
+            conversation.last_message_id = last_message.id
+            conversation.last_message_at = last_message.timestamp
+            conversation.preview = last_message.content[:100]
+        conversation.unread_count = (
+            messages.filter(
+                read_at__isnull=True, id__gt=conversation.last_read_message_id
+            )
+            .exclude(sender_id=conversation.user_id)
+            .count()
+        )
+        conversation.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0010_conversation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="preview",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="unread_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="conversation",
+            index=models.Index(
+                fields=["user", "-last_message_id"],
+                name="chat_conver_user_id_b76603_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
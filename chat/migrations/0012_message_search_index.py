@@ -0,0 +1,75 @@
+from django.db import migrations
+
+# A frozen copy of the folding rules chat.search used when this migration was
+# written; the live module can change without rewriting history.
+FTS_TABLE = "chat_message_fts"
+POSTGRES_INDEX = "chat_message_content_fts"
+PERSIAN_FOLDING = {
+    "ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه", "أ": "ا", "إ": "ا",
+    "\u200c": " ", "ـ": "",
+    **{chr(code): "" for code in range(0x064B, 0x0653)}, "\u0670": "",
+}
+
+
+def sqlite_folded(column):
+    expression = column
+    for source, target in PERSIAN_FOLDING.items():
+        expression = f"replace({expression}, '{source}', '{target}')"
+    return expression
+
+
+def postgres_folded(column):
+    mapped = [(source, target) for source, target in PERSIAN_FOLDING.items() if target]
+    dropped = [source for source, target in PERSIAN_FOLDING.items() if not target]
+    sources = "".join(source for source, _ in mapped) + "".join(dropped)
+    targets = "".join(target for _, target in mapped)
+    return f"lower(translate({column}, '{sources}', '{targets}'))"
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        statements = [
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(content, content='chat_message', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON chat_message BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, {sqlite_folded('new.content')}); END",
+            f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON chat_message BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) "
+            f"VALUES ('delete', old.id, {sqlite_folded('old.content')}); END",
+            f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF content ON chat_message BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) "
+            f"VALUES ('delete', old.id, {sqlite_folded('old.content')}); "
+            f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, {sqlite_folded('new.content')}); END",
+            f"INSERT INTO {FTS_TABLE}(rowid, content) SELECT id, {sqlite_folded('content')} FROM chat_message",
+        ]
+    elif vendor == "postgresql":
+        statements = [
+            f"CREATE INDEX {POSTGRES_INDEX} ON chat_message "
+            f"USING GIN (to_tsvector('simple', {postgres_folded('content')}))",
+        ]
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for trigger in ("insert", "delete", "update"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX IF EXISTS {POSTGRES_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0011_conversation_summary"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
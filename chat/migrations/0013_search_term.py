@@ -0,0 +1,106 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:57
+
+import django.db.models.deletion
+import re
+
+from django.db import migrations, models
+
+# Frozen copies of chat.search's name splitting as of this migration.
+PERSIAN_FOLDING = {
+    "ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه", "أ": "ا", "إ": "ا",
+    "\u200c": " ", "ـ": "",
+    **{chr(code): "" for code in range(0x064B, 0x0653)}, "\u0670": "",
+}
+FOLDING_TABLE = str.maketrans(PERSIAN_FOLDING)
+TOKEN_RE = re.compile(r"[^\W_]+")
+TERM_MAX_LENGTH = 150
+
+
+def name_terms(*names):
+    terms = {}
+    for name in names:
+        folded = " ".join((name or "").translate(FOLDING_TABLE).lower().split())[:TERM_MAX_LENGTH]
+        if not folded:
+            continue
+        terms[folded] = 0
+        for word in TOKEN_RE.findall(folded)[1:]:
+            terms.setdefault(word[:TERM_MAX_LENGTH], 1)
+    return [(rank, term) for term, rank in terms.items()]
+
+
+def backfill_search_terms(apps, schema_editor):
+    SearchTerm = apps.get_model("chat", "SearchTerm")
+    User = apps.get_model("chat", "User")
+    Group = apps.get_model("chat", "Group")
+
+    terms = []
+    for user in User.objects.only("username", "display_name").iterator():
+        for rank, term in name_terms(user.username, user.display_name):
+            terms.append(SearchTerm(kind="user", rank=rank, term=term, user_id=user.id))
+    for group in Group.objects.only("name").iterator():
+        for rank, term in name_terms(group.name):
+            terms.append(
+                SearchTerm(kind="group", rank=rank, term=term, group_id=group.id)
+            )
+    SearchTerm.objects.bulk_create(terms, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0012_message_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchTerm",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("user", "User"), ("group", "Group")], max_length=5
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField(default=0)),
+                ("term", models.CharField(max_length=150)),
+                (
+                    "group",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="chat.group",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="chat.user",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["kind", "rank", "term"],
+                        name="chat_search_kind_eac7a9_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_search_terms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0014_upload_session"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("processing", "Processing"),
+                    ("ready", "Ready"),
+                    ("failed", "Failed"),
+                ],
+                default="ready",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="uploader",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="uploaded_files",
+                to="chat.user",
+            ),
+        ),
+    ]
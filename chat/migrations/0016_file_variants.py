@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0015_file_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="variants",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
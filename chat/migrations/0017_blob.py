@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0016_file_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                ("path", models.CharField(max_length=255)),
+                ("size", models.BigIntegerField()),
+                ("refcount", models.PositiveIntegerField(default=0)),
+                ("status", models.CharField(default="ready", max_length=20)),
+                ("variants", models.JSONField(blank=True, default=dict)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="files",
+                to="chat.blob",
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+def backfill_image_sizes(apps, schema_editor):
+    # Processed images already recorded their size on the "original" variant.
+    for model_name in ("Blob", "File"):
+        model = apps.get_model("chat", model_name)
+        for row in model.objects.exclude(variants={}).only("variants").iterator():
+            original = row.variants.get("original")
+            if original:
+                model.objects.filter(id=row.id).update(
+                    width=original["width"], height=original["height"]
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0017_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blob",
+            name="duration",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="blob",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="blob",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="duration",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_image_sizes, migrations.RunPython.noop),
+    ]
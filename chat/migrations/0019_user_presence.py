@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:17
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0018_media_metadata"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="user",
+            name="chat_user_is_onli_abb16d_idx",
+        ),
+        migrations.RemoveField(
+            model_name="user",
+            name="is_online",
+        ),
+    ]
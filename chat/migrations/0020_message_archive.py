@@ -0,0 +1,83 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0019_user_presence"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedMessage",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("content", models.TextField(blank=True)),
+                ("timestamp", models.DateTimeField()),
+                ("delivered_at", models.DateTimeField(blank=True, null=True)),
+                ("read_at", models.DateTimeField(blank=True, null=True)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "group",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="chat.group",
+                    ),
+                ),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="chat.user",
+                    ),
+                ),
+                (
+                    "sender",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="chat.user",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="archived_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="files",
+                to="chat.archivedmessage",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="archivedmessage",
+            index=models.Index(
+                fields=["group", "id"], name="chat_archiv_group_i_38505a_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="archivedmessage",
+            index=models.Index(
+                fields=["sender", "recipient", "id"],
+                name="chat_archiv_sender__ad783c_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="archivedmessage",
+            index=models.Index(
+                fields=["recipient", "id"], name="chat_archiv_recipie_cf07fa_idx"
+            ),
+        ),
+    ]
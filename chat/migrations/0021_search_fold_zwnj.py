@@ -0,0 +1,114 @@
+import re
+
+from django.db import migrations
+
+# ZWNJ used to fold to a space, so a ZWNJ-joined word was indexed as two
+# tokens that the common spelling without it (میخواهم) never matched. It now
+# folds to nothing, so the message index, its triggers and the name terms are
+# rebuilt. Frozen copies of chat.search's folding, before and after; the order
+# matters because PostgreSQL only uses the index for the identical expression.
+FTS_TABLE = "chat_message_fts"
+POSTGRES_INDEX = "chat_message_content_fts"
+OLD_FOLDING = {
+    "ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه", "أ": "ا", "إ": "ا",
+    "\u200c": " ", "ـ": "",
+    **{chr(code): "" for code in range(0x064B, 0x0653)}, "\u0670": "",
+}
+NEW_FOLDING = {**OLD_FOLDING, "\u200c": ""}
+TOKEN_RE = re.compile(r"[^\W_]+")
+TERM_MAX_LENGTH = 150
+
+
+def sqlite_folded(column, folding):
+    expression = column
+    for source, target in folding.items():
+        expression = f"replace({expression}, '{source}', '{target}')"
+    return expression
+
+
+def postgres_folded(column, folding):
+    mapped = [(source, target) for source, target in folding.items() if target]
+    dropped = [source for source, target in folding.items() if not target]
+    sources = "".join(source for source, _ in mapped) + "".join(dropped)
+    targets = "".join(target for _, target in mapped)
+    return f"lower(translate({column}, '{sources}', '{targets}'))"
+
+
+def name_terms(folding, *names):
+    table = str.maketrans(folding)
+    terms = {}
+    for name in names:
+        folded = " ".join((name or "").translate(table).lower().split())[:TERM_MAX_LENGTH]
+        if not folded:
+            continue
+        terms[folded] = 0
+        for word in TOKEN_RE.findall(folded)[1:]:
+            terms.setdefault(word[:TERM_MAX_LENGTH], 1)
+    return [(rank, term) for term, rank in terms.items()]
+
+
+def rebuild_message_index(schema_editor, folding):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        statements = [f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}" for trigger in ("insert", "delete", "update")]
+        statements += [
+            f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON chat_message BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, {sqlite_folded('new.content', folding)}); END",
+            f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON chat_message BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) "
+            f"VALUES ('delete', old.id, {sqlite_folded('old.content', folding)}); END",
+            f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF content ON chat_message BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) "
+            f"VALUES ('delete', old.id, {sqlite_folded('old.content', folding)}); "
+            f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, {sqlite_folded('new.content', folding)}); END",
+            # The index holds folded text, so it is refilled rather than rebuilt from chat_message.
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')",
+            f"INSERT INTO {FTS_TABLE}(rowid, content) SELECT id, {sqlite_folded('content', folding)} FROM chat_message",
+        ]
+    elif vendor == "postgresql":
+        statements = [
+            f"DROP INDEX IF EXISTS {POSTGRES_INDEX}",
+            f"CREATE INDEX {POSTGRES_INDEX} ON chat_message "
+            f"USING GIN (to_tsvector('simple', {postgres_folded('content', folding)}))",
+        ]
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def rebuild_search_terms(apps, folding):
+    SearchTerm = apps.get_model("chat", "SearchTerm")
+    User = apps.get_model("chat", "User")
+    Group = apps.get_model("chat", "Group")
+
+    SearchTerm.objects.all().delete()
+    terms = []
+    for user in User.objects.only("username", "display_name").iterator():
+        for rank, term in name_terms(folding, user.username, user.display_name):
+            terms.append(SearchTerm(kind="user", rank=rank, term=term, user_id=user.id))
+    for group in Group.objects.only("name").iterator():
+        for rank, term in name_terms(folding, group.name):
+            terms.append(SearchTerm(kind="group", rank=rank, term=term, group_id=group.id))
+    SearchTerm.objects.bulk_create(terms, batch_size=1000)
+
+
+def fold_zwnj(apps, schema_editor):
+    rebuild_message_index(schema_editor, NEW_FOLDING)
+    rebuild_search_terms(apps, NEW_FOLDING)
+
+
+def split_on_zwnj(apps, schema_editor):
+    rebuild_message_index(schema_editor, OLD_FOLDING)
+    rebuild_search_terms(apps, OLD_FOLDING)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0020_message_archive"),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_zwnj, split_on_zwnj),
+    ]
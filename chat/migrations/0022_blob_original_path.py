@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def point_at_original(apps, schema_editor):
+    # Processed images deleted the upload but left the blob's path on it.
+    Blob = apps.get_model("chat", "Blob")
+    for blob in Blob.objects.exclude(variants={}).only("path", "variants").iterator():
+        original = blob.variants.get("original")
+        if original and original["file"] != blob.path:
+            Blob.objects.filter(id=blob.id).update(path=original["file"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0021_search_fold_zwnj"),
+    ]
+
+    operations = [
+        migrations.RunPython(point_at_original, migrations.RunPython.noop),
+    ]
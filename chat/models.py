@@ -1,6 +1,9 @@
-from django.db import models
-from django.contrib.auth.hashers import make_password, check_password
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.contrib.auth.hashers import make_password
 from django.core.files.storage import default_storage
+from .passwords import is_password_hash, hash_password, verify_password, averify_password
 import random
 
 class User(models.Model):
@@ -9,22 +12,33 @@ class User(models.Model):
     password = models.CharField(max_length=128)
     profile_image = models.ImageField(upload_to='profiles/', blank=True, null=True)
     description = models.TextField(blank=True, null=True)
-    is_online = models.BooleanField(default=False)
     last_login = models.DateTimeField(null=True, blank=True, auto_now=True)
     created_at = models.DateTimeField(null=True, blank=True, auto_now_add=True)
 
     def save(self, *args, **kwargs):
         if not self.display_name:
             self.display_name = f"کاربر_{random.randint(1000, 9999)}"
-        if self.password and not self.password.startswith('pbkdf2_'):
+        if self.password and not is_password_hash(self.password):
             self.password = make_password(self.password)
         super().save(*args, **kwargs)
 
     def check_password(self, raw_password):
-        return check_password(raw_password, self.password)
+        valid, upgraded = verify_password(raw_password, self.password)
+        if upgraded:
+            self.password = upgraded
+            # Only the hash is rewritten; save() would also touch last_login.
+            User.objects.filter(id=self.id).update(password=upgraded)
+        return valid
+
+    async def acheck_password(self, raw_password):
+        valid, upgraded = await averify_password(raw_password, self.password)
+        if upgraded:
+            self.password = upgraded
+            await User.objects.filter(id=self.id).aupdate(password=upgraded)
+        return valid
 
     def set_password(self, raw_password):
-        self.password = make_password(raw_password)
+        self.password = hash_password(raw_password)
 
     def __str__(self):
         return self.display_name or self.username
@@ -32,7 +46,6 @@ class User(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['username']),
-            models.Index(fields=['is_online']),
         ]
 
 class Group(models.Model):
@@ -45,14 +58,27 @@ class Group(models.Model):
     created_at = models.DateTimeField(null=True, blank=True, auto_now_add=True)
 
     def save(self, *args, **kwargs):
-        if self.password and not self.password.startswith('pbkdf2_'):
+        if self.password and not is_password_hash(self.password):
             self.password = make_password(self.password)
         super().save(*args, **kwargs)
 
     def check_password(self, raw_password):
         if not self.password:
             return not raw_password
-        return check_password(raw_password, self.password)
+        valid, upgraded = verify_password(raw_password, self.password)
+        if upgraded:
+            self.password = upgraded
+            Group.objects.filter(id=self.id).update(password=upgraded)
+        return valid
+
+    async def acheck_password(self, raw_password):
+        if not self.password:
+            return not raw_password
+        valid, upgraded = await averify_password(raw_password, self.password)
+        if upgraded:
+            self.password = upgraded
+            await Group.objects.filter(id=self.id).aupdate(password=upgraded)
+        return valid
 
     def __str__(self):
         return self.name
@@ -83,8 +109,53 @@ class Message(models.Model):
             models.Index(fields=['sender', 'timestamp']),
             models.Index(fields=['recipient', 'timestamp']),
             models.Index(fields=['group', 'timestamp']),
+            models.Index(fields=['group', 'id']),
+            models.Index(fields=['sender', 'recipient', 'id']),
         ]
 
+class ArchivedMessage(models.Model):
+    """A message moved out of the hot table by ``archive_messages``, under its original id.
+
+    Archived ids always sit below every id still in Message, so history
+    pagination can continue into this table with the same cursor.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    content = models.TextField(blank=True)
+    timestamp = models.DateTimeField()
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sender} -> {self.recipient or self.group}: {self.content[:50]}"
+
+    class Meta:
+        # Only what keyset history pages need; search and edits work on the hot table.
+        indexes = [
+            models.Index(fields=['group', 'id']),
+            models.Index(fields=['sender', 'recipient', 'id']),
+            models.Index(fields=['recipient', 'id']),
+        ]
+
+class Blob(models.Model):
+    """Stored content addressed by its SHA-256, shared by every File with the same bytes."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=20, default='ready')
+    variants = models.JSONField(default=dict, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
 class File(models.Model):
     file = models.FileField(upload_to='uploads/')
     file_type = models.CharField(max_length=20, choices=[
@@ -94,18 +165,107 @@ class File(models.Model):
         ('other', 'Other'),
     ])
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='files', null=True, blank=True)
+    # Set instead of ``message`` once the message has been archived.
+    archived_message = models.ForeignKey(ArchivedMessage, on_delete=models.CASCADE, related_name='files', null=True, blank=True)
+    uploader = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='uploaded_files', null=True, blank=True)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='files', null=True, blank=True)
+    status = models.CharField(max_length=20, default='ready', choices=[
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ])
+    variants = models.JSONField(default=dict, blank=True)
+    # Filled in by the media queue: display size for images and video, duration in seconds for video and audio.
+    duration = models.FloatField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.file.name
 
-    def delete(self, *args, **kwargs):
-        if self.file and default_storage.exists(self.file.name):
-            default_storage.delete(self.file.name)
-        super().delete(*args, **kwargs)
-
     class Meta:
         indexes = [
             models.Index(fields=['uploaded_at']),
             models.Index(fields=['file_type']),
-        ]
\ No newline at end of file
+        ]
+
+@receiver(post_delete, sender=File)
+def release_file_content(sender, instance, **kwargs):
+    # A signal rather than File.delete, so files removed along with their message are released too.
+    if instance.blob_id:
+        # Shared content: drop this reference and let the last one remove the blob.
+        from .blobs import release_blob
+        release_blob(instance.blob_id)
+        return
+    names = {variant['file'] for variant in instance.variants.values()}
+    if instance.file:
+        names.add(instance.file.name)
+
+    def delete_files():
+        for name in names:
+            if default_storage.exists(name):
+                default_storage.delete(name)
+    transaction.on_commit(delete_files)
+
+class UploadSession(models.Model):
+    """A resumable upload whose chunks are appended in place to ``path`` until it is committed."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    file = models.OneToOneField(File, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+
+class Conversation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
+    peer = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='conversations')
+    last_read_message_id = models.BigIntegerField(default=0)
+    last_message_id = models.BigIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    preview = models.CharField(max_length=100, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} @ {self.peer or self.group}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-last_message_id']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'peer'], name='unique_user_peer_conversation'),
+            models.UniqueConstraint(fields=['user', 'group'], name='unique_user_group_conversation'),
+        ]
+
+class SearchTerm(models.Model):
+    """Normalized name prefixes for typeahead search; rank 0 starts the whole name, rank 1 a later word."""
+    KIND_CHOICES = (
+        ('user', 'User'),
+        ('group', 'Group'),
+    )
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    rank = models.PositiveSmallIntegerField(default=0)
+    term = models.CharField(max_length=150)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+
+    def __str__(self):
+        return self.term
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'rank', 'term']),
+        ]
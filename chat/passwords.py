@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, check_password, get_hasher, identify_hasher, make_password
+from django.core.cache import cache
+import asyncio
+
+# Hashing is deliberately expensive, so it runs on its own pool of about one
+# thread per core: a burst of logins queues here instead of every worker
+# thread hashing at once, and async views await it without holding the
+# event loop or the thread that runs sync views.
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='passwords')
+
+# Wrong passwords are counted per account and client address; past the limit
+# attempts are refused without hashing until the window runs out. Guesses
+# spread over many addresses only slow the account down: refusing them would
+# let anyone lock the owner out.
+FAILURE_WINDOW = 60 * 5
+FAILURE_LIMIT = 5
+ACCOUNT_FAILURE_LIMIT = 50
+ACCOUNT_FAILURE_DELAY = 2
+
+
+def is_password_hash(value):
+    """Whether ``value`` is already an encoded hash (or unusable marker) rather than a raw password."""
+    if value.startswith(UNUSABLE_PASSWORD_PREFIX):
+        return True
+    try:
+        identify_hasher(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _verify(raw_password, encoded):
+    """(valid, upgraded): ``upgraded`` is a fresh hash when ``encoded`` uses an outdated hasher or cost."""
+    if not check_password(raw_password, encoded):
+        return False, None
+    preferred = get_hasher('default')
+    if identify_hasher(encoded).algorithm != preferred.algorithm or preferred.must_update(encoded):
+        return True, make_password(raw_password)
+    return True, None
+
+
+def verify_password(raw_password, encoded):
+    return _hash_executor.submit(_verify, raw_password, encoded).result()
+
+
+async def averify_password(raw_password, encoded):
+    return await asyncio.wrap_future(_hash_executor.submit(_verify, raw_password, encoded))
+
+
+def hash_password(raw_password):
+    return _hash_executor.submit(make_password, raw_password).result()
+
+
+async def ahash_password(raw_password):
+    return await asyncio.wrap_future(_hash_executor.submit(make_password, raw_password))
+
+
+class FailureThrottle:
+    """Counts failed password checks in the cache, shared by every worker."""
+
+    def __init__(self, scope):
+        self.scope = scope
+
+    def keys(self, account, address):
+        return f'{self.scope}_failures:{account}:{address}', f'{self.scope}_failures:{account}'
+
+    async def blocked(self, account, address):
+        """Whether this address is locked out of the account; first waits if the whole account is under attack."""
+        key, account_key = self.keys(account, address)
+        counts = await cache.aget_many([key, account_key])
+        if counts.get(key, 0) >= FAILURE_LIMIT:
+            return True
+        if counts.get(account_key, 0) >= ACCOUNT_FAILURE_LIMIT:
+            await asyncio.sleep(ACCOUNT_FAILURE_DELAY)
+        return False
+
+    async def failed(self, account, address):
+        for key in self.keys(account, address):
+            # The window starts at the first failure and is not extended by later ones.
+            await cache.aadd(key, 0, FAILURE_WINDOW)
+            try:
+                await cache.aincr(key)
+            except ValueError:
+                # Expired between the two calls.
+                await cache.aset(key, 1, FAILURE_WINDOW)
+
+    async def succeeded(self, account, address):
+        await cache.adelete(self.keys(account, address)[0])
+
+
+login_throttle = FailureThrottle('login')
+join_throttle = FailureThrottle('group_join')
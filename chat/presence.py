@@ -0,0 +1,91 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from .models import Conversation
+from .realtime import publish, user_group_name
+import asyncio
+import time
+
+# A user is online while their presence key exists. Clients beat every
+# HEARTBEAT_INTERVAL seconds, so a closed browser drops out after PRESENCE_TTL
+# without anyone having to notice the disconnect.
+HEARTBEAT_INTERVAL = 25
+PRESENCE_TTL = 60
+# A closed socket keeps the key this long, so another open tab can renew it before it lapses.
+DISCONNECT_GRACE = HEARTBEAT_INTERVAL + 5
+
+_expiry_tasks = set()
+
+
+def presence_key(user_id):
+    return f'presence:{user_id}'
+
+
+def heartbeat(user_id):
+    """Keep the user online for another PRESENCE_TTL seconds; returns True if they were offline."""
+    key = presence_key(user_id)
+    if cache.add(key, time.time(), timeout=PRESENCE_TTL):
+        publish_presence(user_id, True)
+        return True
+    cache.set(key, time.time(), timeout=PRESENCE_TTL)
+    return False
+
+
+def go_offline(user_id):
+    cache.delete(presence_key(user_id))
+    publish_presence(user_id, False)
+
+
+def disconnect(user_id):
+    cache.touch(presence_key(user_id), DISCONNECT_GRACE)
+
+
+def schedule_expiry(user_id):
+    """Called on the event loop when a socket closes."""
+    task = asyncio.get_running_loop().create_task(expire_after_disconnect(user_id))
+    # The loop only keeps weak references to tasks.
+    _expiry_tasks.add(task)
+    task.add_done_callback(_expiry_tasks.discard)
+
+
+async def expire_after_disconnect(user_id):
+    # The key lapses silently, so tell contacts once the grace period is over
+    # unless another connection renewed it in the meantime.
+    await asyncio.sleep(DISCONNECT_GRACE + 1)
+    if not await sync_to_async(is_online)(user_id):
+        await sync_to_async(publish_presence)(user_id, False)
+
+
+def is_online(user_id):
+    return cache.get(presence_key(user_id)) is not None
+
+
+def online(user_ids):
+    """The subset of ``user_ids`` that is online, in one cache round trip."""
+    keys = {presence_key(user_id): user_id for user_id in user_ids}
+    if not keys:
+        return set()
+    return {keys[key] for key in cache.get_many(list(keys))}
+
+
+def annotate_online(users):
+    """Set ``is_online`` on User instances so serializing them needs no further lookups."""
+    online_ids = online({user.id for user in users})
+    for user in users:
+        user.is_online = user.id in online_ids
+    return users
+
+
+def mark_online(users_data):
+    """Refresh ``is_online`` in already serialized users, e.g. ones read back from a cache."""
+    online_ids = online({user['id'] for user in users_data})
+    return [{**user, 'is_online': user['id'] in online_ids} for user in users_data]
+
+
+def presence_audience(user_id):
+    # Only people with a private chat open to the user show their status.
+    user_ids = Conversation.objects.filter(peer_id=user_id).values_list('user_id', flat=True)
+    return [user_group_name(watcher_id) for watcher_id in user_ids]
+
+
+def publish_presence(user_id, now_online):
+    publish(presence_audience(user_id), {'type': 'presence.changed', 'user_id': user_id, 'online': now_online})
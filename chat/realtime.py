@@ -0,0 +1,94 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+
+def chat_group_name(group_id):
+    return f'group_{group_id}'
+
+
+def message_audience(message_data):
+    """Channel-layer groups that should receive a serialized message."""
+    if message_data.get('group'):
+        return [chat_group_name(message_data['group']['id'])]
+    names = [user_group_name(message_data['sender']['id'])]
+    if message_data.get('recipient'):
+        names.append(user_group_name(message_data['recipient']['id']))
+    return names
+
+
+def publish(group_names, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for name in group_names:
+        try:
+            async_to_sync(channel_layer.group_send)(name, event)
+        except Exception as e:
+            # Push is best effort: clients still catch up through /api/messages/.
+            logger.error(f"Error publishing {event.get('type')} to {name}: {str(e)}")
+
+
+def publish_message(message_data):
+    publish(message_audience(message_data), {'type': 'message.new', 'message': message_data})
+
+
+def publish_seen(group_names, reader_id, message_ids):
+    if message_ids:
+        publish(group_names, {'type': 'messages.seen', 'reader_id': reader_id, 'message_ids': message_ids})
+
+
+def subscribe_group(user_id, group_id):
+    """Ask the user's open sockets to start listening to a group they just joined."""
+    publish([user_group_name(user_id)], {'type': 'group.joined', 'group_id': group_id})
+
+
+class LongPollListener:
+    """A long-poll request's own channel on the channel layer, added to the groups it waits on.
+
+    ``publish_message`` already sends ``message.new`` to those groups, so a
+    message posted through any worker wakes the request once the layer is
+    shared (Redis). Requests subscribe before their first query so a message
+    sent in between is never missed, then sleep on the event loop instead of
+    re-querying.
+    """
+
+    def __init__(self, layer, channel):
+        self.layer = layer
+        self.channel = channel
+
+    async def wait(self, timeout):
+        """Whether a new message arrived within ``timeout`` seconds; other events on the groups are skipped."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                event = await asyncio.wait_for(self.layer.receive(self.channel), remaining)
+            except asyncio.TimeoutError:
+                return False
+            if event.get('type') == 'message.new':
+                return True
+
+
+@asynccontextmanager
+async def listen(names):
+    layer = get_channel_layer()
+    channel = await layer.new_channel('longpoll.')
+    for name in names:
+        await layer.group_add(name, channel)
+    try:
+        yield LongPollListener(layer, channel)
+    finally:
+        for name in names:
+            await layer.group_discard(name, channel)
@@ -0,0 +1,166 @@
+from django.db import connection, models
+from .models import Message, Group, SearchTerm
+from .cache import typeahead_cache
+import hashlib
+import re
+
+# Persian text arrives in several spellings of the "same" word: Arabic yeh and
+# kaf, optional harakat, tatweel and a ZWNJ that is as often left out as typed
+# (می‌خواهم / میخواهم), so it folds to nothing. Both the index and the query
+# are folded through this table; the index keeps the copy frozen in its latest
+# migration (0021), so changing the table needs a new one. It is kept short on purpose:
+# SQLite applies it as nested replace() calls inside triggers, whose parser
+# depth is limited, so digits are matched by expanding the query instead.
+PERSIAN_FOLDING = {
+    'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه', 'أ': 'ا', 'إ': 'ا',
+    '\u200c': '', 'ـ': '',
+    **{chr(code): '' for code in range(0x064B, 0x0653)}, '\u0670': '',
+}
+FOLDING_TABLE = str.maketrans(PERSIAN_FOLDING)
+DIGIT_SETS = ['0123456789', '۰۱۲۳۴۵۶۷۸۹', '٠١٢٣٤٥٦٧٨٩']
+TO_ASCII_DIGITS = str.maketrans(''.join(DIGIT_SETS[1:]), DIGIT_SETS[0] * 2)
+TOKEN_RE = re.compile(r'[^\W_]+')
+SQLITE_TABLE = 'chat_message_fts'
+TYPEAHEAD_LIMIT = 20
+TERM_MAX_LENGTH = 150
+
+
+def normalize(text):
+    return (text or '').translate(FOLDING_TABLE).lower()
+
+
+def query_tokens(query):
+    return TOKEN_RE.findall(normalize(query))
+
+
+def token_variants(token):
+    """The token written with each digit set, since stored text keeps whichever digits were typed."""
+    token = token.translate(TO_ASCII_DIGITS)
+    return list(dict.fromkeys(token.translate(str.maketrans(DIGIT_SETS[0], digits)) for digits in DIGIT_SETS))
+
+
+def _postgres_folded(column):
+    # translate() maps character for character and drops sources without a target.
+    mapped = [(source, target) for source, target in PERSIAN_FOLDING.items() if target]
+    dropped = [source for source, target in PERSIAN_FOLDING.items() if not target]
+    sources = ''.join(source for source, _ in mapped) + ''.join(dropped)
+    targets = ''.join(target for _, target in mapped)
+    return f"lower(translate({column}, '{sources}', '{targets}'))"
+
+
+def search_messages(user_id, query, limit, offset=0, group_id=None, peer_id=None):
+    """Ids of messages the user can see that match ``query``, best match first.
+
+    Every token is matched as a prefix, so typing part of a word already finds it.
+    Only the hot table is indexed; archived messages are reachable through history.
+    """
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+
+    if group_id:
+        scope, scope_params = 'm.group_id = %s', [group_id]
+    elif peer_id:
+        scope = '((m.sender_id = %s AND m.recipient_id = %s) OR (m.sender_id = %s AND m.recipient_id = %s))'
+        scope_params = [user_id, peer_id, peer_id, user_id]
+    else:
+        membership = Group.members.through._meta.db_table
+        scope = (f'(m.sender_id = %s OR m.recipient_id = %s OR m.group_id IN '
+                 f'(SELECT group_id FROM {membership} WHERE user_id = %s))')
+        scope_params = [user_id, user_id, user_id]
+
+    if connection.vendor == 'sqlite':
+        match = ' AND '.join(
+            '(' + ' OR '.join(f'"{variant}"*' for variant in token_variants(token)) + ')' for token in tokens
+        )
+        sql = (f'SELECT m.id FROM {SQLITE_TABLE} f JOIN chat_message m ON m.id = f.rowid '
+               f'WHERE {SQLITE_TABLE} MATCH %s AND {scope} ORDER BY bm25({SQLITE_TABLE}), m.id DESC LIMIT %s OFFSET %s')
+        params = [match, *scope_params, limit, offset]
+    elif connection.vendor == 'postgresql':
+        vector = f"to_tsvector('simple', {_postgres_folded('m.content')})"
+        tsquery = "to_tsquery('simple', %s)"
+        match = ' & '.join(
+            '(' + ' | '.join(f'{variant}:*' for variant in token_variants(token)) + ')' for token in tokens
+        )
+        sql = (f'SELECT m.id FROM chat_message m WHERE {vector} @@ {tsquery} AND {scope} '
+               f'ORDER BY ts_rank({vector}, {tsquery}) DESC, m.id DESC LIMIT %s OFFSET %s')
+        params = [match, *scope_params, match, limit, offset]
+    else:
+        visible = Message.objects.filter(
+            models.Q(sender_id=user_id) | models.Q(recipient_id=user_id) |
+            models.Q(group_id__in=Group.objects.filter(members__id=user_id).values('id'))
+        )
+        if group_id:
+            visible = visible.filter(group_id=group_id)
+        elif peer_id:
+            visible = visible.filter(models.Q(sender_id=peer_id) | models.Q(recipient_id=peer_id))
+        for token in tokens:
+            matches = models.Q()
+            for variant in token_variants(token):
+                matches |= models.Q(content__icontains=variant)
+            visible = visible.filter(matches)
+        return list(visible.order_by('-id').values_list('id', flat=True)[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def name_terms(*names):
+    """(rank, term) pairs for typeahead: each name as a whole, then every later word in it."""
+    terms = {}
+    for name in names:
+        folded = ' '.join(normalize(name).split())[:TERM_MAX_LENGTH]
+        if not folded:
+            continue
+        terms[folded] = 0
+        for word in TOKEN_RE.findall(folded)[1:]:
+            terms.setdefault(word[:TERM_MAX_LENGTH], 1)
+    return [(rank, term) for term, rank in terms.items()]
+
+
+def index_user(user):
+    SearchTerm.objects.filter(user=user).delete()
+    SearchTerm.objects.bulk_create([
+        SearchTerm(kind='user', rank=rank, term=term, user=user)
+        for rank, term in name_terms(user.username, user.display_name)
+    ])
+    typeahead_cache.invalidate('user')
+
+
+def index_group(group):
+    SearchTerm.objects.filter(group=group).delete()
+    SearchTerm.objects.bulk_create([
+        SearchTerm(kind='group', rank=rank, term=term, group=group)
+        for rank, term in name_terms(group.name)
+    ])
+    typeahead_cache.invalidate('group')
+
+
+def typeahead(kind, query, limit=TYPEAHEAD_LIMIT):
+    """Ids of users or groups whose name starts with ``query``, whole-name matches before later words.
+
+    Each rank is a range scan on the (kind, rank, term) index, so the cost
+    depends on ``limit`` rather than on the size of the table.
+    """
+    prefix = ' '.join(normalize(query).split())[:TERM_MAX_LENGTH]
+    if not prefix:
+        return []
+    digest = hashlib.sha1(f'{limit}:{prefix}'.encode()).hexdigest()
+    return typeahead_cache.get_or_set(kind, lambda: typeahead_ids(kind, prefix, limit), digest)
+
+
+def typeahead_ids(kind, prefix, limit):
+    column = 'user_id' if kind == 'user' else 'group_id'
+    ids = []
+    for rank in (0, 1):
+        # An object can own several matching words, so read a little past the limit.
+        matches = SearchTerm.objects.filter(
+            kind=kind, rank=rank, term__gte=prefix, term__lt=prefix + '\U0010ffff'
+        ).order_by('term').values_list(column, flat=True)[:limit * 2]
+        for object_id in matches:
+            if object_id not in ids:
+                ids.append(object_id)
+        if len(ids) >= limit:
+            break
+    return ids[:limit]
@@ -1,15 +1,41 @@
 from rest_framework import serializers
-from .models import User, Group, Message, File
+from .models import User, Group, Message, File, Conversation
+from .presence import annotate_online, is_online
+import django.db.models as models
+
+class UserListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        return super().to_representation(annotate_online(users))
 
 class UserSerializer(serializers.ModelSerializer):
+    is_online = serializers.SerializerMethodField()
+
     class Meta:
         model = User
         fields = ['id', 'username', 'display_name', 'profile_image', 'is_online', 'description']
+        list_serializer_class = UserListSerializer
+
+    def get_is_online(self, obj):
+        # Lists look presence up in one batch beforehand; a single user falls back to its own lookup.
+        online = getattr(obj, 'is_online', None)
+        return online if online is not None else is_online(obj.id)
+
+def variant_urls(variants, storage):
+    return {
+        name: {'url': storage.url(variant['file']), 'width': variant['width'], 'height': variant['height']}
+        for name, variant in variants.items()
+    }
 
 class FileSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = File
-        fields = ['id', 'file', 'file_type', 'uploaded_at']
+        fields = ['id', 'file', 'file_type', 'status', 'variants', 'duration', 'width', 'height', 'uploaded_at']
+
+    def get_variants(self, obj):
+        return variant_urls(obj.variants, obj.file.storage)
 
 class GroupSerializer(serializers.ModelSerializer):
     creator = UserSerializer(read_only=True)
@@ -23,6 +49,23 @@ class GroupSerializer(serializers.ModelSerializer):
         model = Group
         fields = ['id', 'name', 'description', 'creator', 'creator_id', 'members', 'image', 'created_at']
 
+class GroupListSerializer(serializers.ModelSerializer):
+    member_count = serializers.IntegerField(read_only=True)
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'description', 'image', 'member_count', 'last_message']
+
+    def get_last_message(self, obj):
+        if not obj.last_message_id:
+            return None
+        return {
+            'id': obj.last_message_id,
+            'content': obj.last_message_content,
+            'timestamp': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
+
 class MessageSerializer(serializers.ModelSerializer):
     sender = serializers.SerializerMethodField()
     recipient = serializers.SerializerMethodField()
@@ -57,4 +100,62 @@ class MessageSerializer(serializers.ModelSerializer):
     def validate(self, data):
         if not data.get('content') and not data.get('file_ids'):
             raise serializers.ValidationError("محتوا یا فایل الزامی است")
-        return data
\ No newline at end of file
+        return data
+
+class ConversationSerializer(serializers.ModelSerializer):
+    peer = UserSerializer(read_only=True)
+    group = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Conversation
+        fields = ['id', 'peer', 'group', 'last_message_id', 'last_message_at', 'preview', 'unread_count']
+
+    def get_group(self, obj):
+        if not obj.group:
+            return None
+        return {'id': obj.group.id, 'name': obj.group.name, 'image': obj.group.image.url if obj.group.image else None}
+
+MESSAGE_ROW_FIELDS = ['id', 'sender_id', 'recipient_id', 'group_id', 'group__name', 'content', 'timestamp', 'delivered_at', 'read_at']
+
+def serialize_messages(rows):
+    """Same output as ``MessageSerializer(many=True).data`` for ``values(*MESSAGE_ROW_FIELDS)`` rows.
+
+    Users are serialized once per response and files are loaded in one query,
+    so no serializer object is built per message.
+    """
+    if not rows:
+        return []
+    user_ids = {row['sender_id'] for row in rows} | {row['recipient_id'] for row in rows if row['recipient_id']}
+    users = {user['id']: user for user in UserSerializer(User.objects.filter(id__in=user_ids), many=True).data}
+
+    date_field = serializers.DateTimeField()
+    storage = File._meta.get_field('file').storage
+    files = {}
+    ids = [row['id'] for row in rows]
+    attached = models.Q(message_id__in=ids) | models.Q(archived_message_id__in=ids)
+    for file in File.objects.filter(attached).order_by('id').values(
+            'id', 'file', 'file_type', 'status', 'variants', 'duration', 'width', 'height', 'uploaded_at',
+            'message_id', 'archived_message_id'):
+        files.setdefault(file['message_id'] or file['archived_message_id'], []).append({
+            'id': file['id'],
+            'file': storage.url(file['file']) if file['file'] else None,
+            'file_type': file['file_type'],
+            'status': file['status'],
+            'variants': variant_urls(file['variants'], storage),
+            'duration': file['duration'],
+            'width': file['width'],
+            'height': file['height'],
+            'uploaded_at': date_field.to_representation(file['uploaded_at']),
+        })
+
+    return [{
+        'id': row['id'],
+        'sender': users[row['sender_id']],
+        'recipient': users[row['recipient_id']] if row['recipient_id'] else None,
+        'group': {'id': row['group_id'], 'name': row['group__name']} if row['group_id'] else None,
+        'content': row['content'],
+        'timestamp': date_field.to_representation(row['timestamp']),
+        'delivered_at': date_field.to_representation(row['delivered_at']),
+        'read_at': date_field.to_representation(row['read_at']),
+        'files': files.get(row['id'], []),
+    } for row in rows]
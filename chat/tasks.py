@@ -0,0 +1,167 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from .models import Blob, File
+from .serializers import FileSerializer
+from .realtime import publish, user_group_name, chat_group_name
+from . import imaging, transcoding
+import logging
+import multiprocessing
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+MEDIA_QUEUE_KEY = 'chat:media'
+
+# ``func(*args)`` runs in a worker process; ``outputs`` maps each variant it writes to a storage name.
+Job = namedtuple('Job', ['func', 'args', 'outputs', 'file_type'])
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the server process has threads and open connections.
+            _executor = ProcessPoolExecutor(max_workers=settings.MEDIA_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def redis_client():
+    import redis
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+def needs_processing(file_type):
+    """Whether uploads of this type have work waiting in the media queue on this deployment."""
+    if file_type == 'image':
+        return True
+    if file_type in transcoding.PLAYBACK_EXTENSIONS:
+        return transcoding.available(settings.FFMPEG_BINARY, settings.FFPROBE_BINARY)
+    return False
+
+
+def enqueue_file(file_id):
+    """Schedule background processing for a File once the row creating it is committed."""
+    transaction.on_commit(lambda: dispatch(file_id))
+
+
+def dispatch(file_id):
+    try:
+        _dispatch(file_id)
+    except Exception as e:
+        # The file stays "processing"; process_media --requeue picks it up later.
+        logger.error(f"Error queueing file {file_id}: {str(e)}")
+
+
+def _dispatch(file_id):
+    if settings.MEDIA_QUEUE == 'redis':
+        redis_client().lpush(MEDIA_QUEUE_KEY, file_id)
+    elif settings.MEDIA_QUEUE == 'inline':
+        process_file(file_id)
+    else:
+        job = build_job(file_id)
+        if job is None:
+            return
+        future = executor().submit(job.func, *job.args)
+        future.add_done_callback(lambda done: _finish_in_thread(file_id, job, done))
+
+
+def build_job(file_id):
+    """The Job for a File still waiting to be processed, or None."""
+    file = File.objects.filter(id=file_id, status='processing').first()
+    if file is None:
+        return None
+    stem = os.path.splitext(file.file.name)[0]
+    if file.file_type in transcoding.PLAYBACK_EXTENSIONS:
+        outputs = {'poster': f"{stem}_poster.{transcoding.POSTER_EXTENSION}"}
+        if settings.MEDIA_RENDITION in transcoding.RENDITION_MODES:
+            outputs['playback'] = f"{stem}_playback.{transcoding.PLAYBACK_EXTENSIONS[file.file_type]}"
+        targets = {name: default_storage.path(output) for name, output in outputs.items()}
+        args = (default_storage.path(file.file.name), targets, file.file_type, settings.MEDIA_RENDITION,
+                settings.FFMPEG_BINARY, settings.FFPROBE_BINARY)
+        return Job(transcoding.make_media_variants, args, outputs, file.file_type)
+
+    image_format = imaging.preferred_format()
+    outputs = {
+        name: f"{stem}_{name}.{imaging.FORMAT_EXTENSIONS[image_format]}"
+        for name in imaging.VARIANT_SIZES
+    }
+    targets = {name: default_storage.path(output) for name, output in outputs.items()}
+    return Job(imaging.make_variants, (default_storage.path(file.file.name), targets, image_format), outputs, 'image')
+
+
+def process_file(file_id):
+    """Run a File's job in this process; used by the Redis worker and the inline mode."""
+    job = build_job(file_id)
+    if job is None:
+        return
+    try:
+        result = job.func(*job.args)
+    except Exception as e:
+        finish(file_id, job, error=e)
+    else:
+        finish(file_id, job, result=result)
+
+
+def _finish_in_thread(file_id, job, future):
+    # Done callbacks run on the pool's management thread, which owns its own connection.
+    try:
+        error = future.exception()
+        finish(file_id, job, result=None if error else future.result(), error=error)
+    finally:
+        connections.close_all()
+
+
+def finish(file_id, job, result=None, error=None):
+    file = File.objects.filter(id=file_id).first()
+    if file is None:
+        return
+    # Every File sharing the blob waits on this one job.
+    files = File.objects.filter(blob_id=file.blob_id) if file.blob_id else File.objects.filter(id=file.id)
+    if error is not None:
+        logger.error(f"Error processing file {file.file.name}: {str(error)}")
+        fields = {'status': 'failed'}
+    else:
+        if job.file_type == 'image':
+            metadata = {'width': result['original']['width'], 'height': result['original']['height']}
+        else:
+            metadata, result = result
+        variants = {
+            name: {'file': job.outputs[variant['source']], 'width': variant['width'], 'height': variant['height']}
+            for name, variant in result.items()
+        }
+        fields = {'status': 'ready', 'variants': variants, **metadata}
+    # The full-size variant replaces the upload for the blob and all its files, so links to ``file`` keep working.
+    replaced = error is None and job.file_type == 'image'
+    if file.blob_id:
+        blob_fields = dict(fields, path=fields['variants']['original']['file']) if replaced else fields
+        Blob.objects.filter(id=file.blob_id).update(**blob_fields)
+    if replaced:
+        files.update(file=fields['variants']['original']['file'], **fields)
+        default_storage.delete(file.file.name)
+    else:
+        files.update(**fields)
+    for processed in files.select_related('message'):
+        publish_file_status(processed)
+
+
+def publish_file_status(file):
+    names = []
+    if file.uploader_id:
+        names.append(user_group_name(file.uploader_id))
+    message = file.message
+    if message is not None:
+        if message.group_id:
+            names.append(chat_group_name(message.group_id))
+        else:
+            names += [user_group_name(message.sender_id), user_group_name(message.recipient_id)]
+    data = FileSerializer(file).data
+    data['message_id'] = file.message_id
+    publish(list(dict.fromkeys(names)), {'type': 'file.status', 'file': data})
@@ -1,3 +1,782 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.contrib.auth.hashers import identify_hasher, get_hasher, make_password
+from django.core.management import call_command
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from .blobs import blob_name
+from .archive import ARCHIVE_BOUNDARY_KEY, archive_batch, archive_boundary, history_page
+from .cache import VersionedCache
+from .models import User, Group, Message, ArchivedMessage, UploadSession, Blob, File, Conversation
+from .serializers import MessageSerializer, MESSAGE_ROW_FIELDS, serialize_messages
+from .search import search_messages, index_user, typeahead
+from .conversations import record_message
+from .fanout import fan_out, group_member_ids
+from .realtime import user_group_name
+from .media import can_access, parse_range
+from . import passwords, presence
+from .ephemeral import SIGNAL_BURST, SIGNAL_RATE, SIGNAL_REPEAT_INTERVAL, SignalThrottle
+from .tasks import Job, finish
+from . import transcoding
+from .uploads import OffsetMismatch, IncompleteChunk, ChecksumMismatch, AlreadyCommitted, hashers, start_upload, write_chunk, commit_upload, store_upload, create_file
+from channels.layers import get_channel_layer
+from rest_framework.renderers import JSONRenderer
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+
+class VersionedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.versioned = VersionedCache('tests', timeout=60)
+
+    def test_fill_is_cached(self):
+        calls = []
+        fill = lambda: calls.append(1) or len(calls)
+        self.assertEqual(self.versioned.get_or_set(1, fill), 1)
+        self.assertEqual(self.versioned.get_or_set(1, fill), 1)
+        self.assertEqual(len(calls), 1)
+
+    def test_invalidate_during_fill_is_not_lost(self):
+        # A writer commits and invalidates while the reader is still querying.
+        def stale():
+            self.versioned.invalidate(1)
+            return 'stale'
+
+        self.versioned.get_or_set(1, lambda: 'first')
+        self.versioned.invalidate(1)
+        self.assertEqual(self.versioned.get_or_set(1, stale), 'stale')
+        self.assertEqual(self.versioned.get_or_set(1, lambda: 'fresh'), 'fresh')
+
+    def test_scopes_are_separate(self):
+        self.versioned.get_or_set(1, lambda: 'one')
+        self.versioned.invalidate(2)
+        self.assertEqual(self.versioned.get_or_set(1, lambda: 'other'), 'one')
+
+
+class ZwnjSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create(username='sender', display_name='می\u200cخواهم')
+        self.recipient = User.objects.create(username='recipient')
+        index_user(self.sender)
+
+    def test_message_matches_with_or_without_zwnj(self):
+        joined = Message.objects.create(sender=self.sender, recipient=self.recipient, content='می\u200cخواهم بروم')
+        plain = Message.objects.create(sender=self.sender, recipient=self.recipient, content='میخواهم بمانم')
+        for query in ('میخواهم', 'می\u200cخواهم'):
+            self.assertCountEqual(search_messages(self.recipient.id, query, 10), [joined.id, plain.id])
+
+    def test_name_matches_with_or_without_zwnj(self):
+        self.assertEqual(typeahead('user', 'میخوا'), [self.sender.id])
+        self.assertEqual(typeahead('user', 'می\u200cخوا'), [self.sender.id])
+
+
+class UploadTests(TestCase):
+    data = bytes(range(256)) * 40
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.user = User.objects.create(username='uploader')
+        self.upload = start_upload(self.user.id, 'data.bin', len(self.data), 'application/octet-stream')
+
+    def send(self, start, end, upload=None):
+        return write_chunk(upload or self.upload, start, end - start, io.BytesIO(self.data[start:end]))
+
+    def test_chunks_commit_to_file(self):
+        self.send(0, 4000)
+        self.send(4000, len(self.data))
+        file, digest = commit_upload(self.upload, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(digest, hashlib.sha256(self.data).hexdigest())
+        with file.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.data)
+
+    def test_offset_mismatch(self):
+        self.send(0, 4000)
+        with self.assertRaises(OffsetMismatch) as raised:
+            self.send(2000, 6000)
+        self.assertEqual(raised.exception.offset, 4000)
+
+    def test_stale_retry_leaves_file_alone(self):
+        # A retry still holding the session as it was before the first attempt landed.
+        stale = UploadSession.objects.get(id=self.upload.id)
+        self.send(0, 4000)
+        with self.assertRaises(OffsetMismatch) as raised:
+            self.send(0, 1000, stale)
+        self.assertEqual(raised.exception.offset, 4000)
+        self.send(4000, len(self.data))
+        file, _ = commit_upload(self.upload, hashlib.sha256(self.data).hexdigest())
+        with file.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.data)
+
+    def test_partial_chunk_keeps_received_bytes(self):
+        with self.assertRaises(IncompleteChunk) as raised:
+            write_chunk(self.upload, 0, 4000, io.BytesIO(self.data[:1500]))
+        self.assertEqual(raised.exception.args[0], 1500)
+        self.assertEqual(UploadSession.objects.get(id=self.upload.id).received, 1500)
+        self.send(1500, len(self.data))
+        _, digest = commit_upload(self.upload)
+        self.assertEqual(digest, hashlib.sha256(self.data).hexdigest())
+
+    def test_resume_after_restart(self):
+        self.send(0, 4000)
+        # A new process has neither the session object nor the running hash.
+        hashers.drop(self.upload.id)
+        upload = UploadSession.objects.get(id=self.upload.id)
+        self.send(upload.received, len(self.data), upload)
+        _, digest = commit_upload(upload)
+        self.assertEqual(digest, hashlib.sha256(self.data).hexdigest())
+
+    def test_checksum_mismatch(self):
+        self.send(0, len(self.data))
+        with self.assertRaises(ChecksumMismatch):
+            commit_upload(self.upload, hashlib.sha256(b'other').hexdigest())
+        self.assertIsNone(UploadSession.objects.get(id=self.upload.id).file_id)
+
+    def test_second_commit_conflicts(self):
+        # A concurrent commit that loaded the session before the first one finished.
+        stale = UploadSession.objects.get(id=self.upload.id)
+        self.send(0, len(self.data))
+        stale.received = len(self.data)
+        file, _ = commit_upload(self.upload)
+        with self.assertRaises(AlreadyCommitted) as raised:
+            commit_upload(stale)
+        self.assertEqual(raised.exception.file_id, file.id)
+
+
+class BlobTests(TestCase):
+    data = b'same bytes'
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.user = User.objects.create(username='uploader')
+        self.writes = []
+
+    def upload(self, content_type='application/octet-stream', filename='a.bin'):
+        def write(name):
+            self.writes.append(name)
+            return default_storage.save(name, ContentFile(self.data))
+        blob, created = store_upload(self.sha256, len(self.data), filename, content_type, write)
+        return create_file(blob, created, content_type, self.user.id)
+
+    def test_identical_uploads_share_one_blob(self):
+        first, second = self.upload(), self.upload()
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(Blob.objects.get(id=first.blob_id).refcount, 2)
+        self.assertEqual(len(self.writes), 1)
+
+    def test_last_release_deletes_blob(self):
+        first, second = self.upload(), self.upload()
+        path = first.blob.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get(id=second.blob_id).refcount, 1)
+        self.assertTrue(default_storage.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.filter(sha256=self.sha256).exists())
+        self.assertFalse(default_storage.exists(path))
+
+    def test_stored_name_is_used(self):
+        # Storage renames the write when the name appears between the check and the save.
+        def write(name):
+            default_storage.save(name, ContentFile(self.data))
+            return default_storage.save(name, ContentFile(self.data))
+        blob, _ = store_upload(self.sha256, len(self.data), 'a.bin', 'application/octet-stream', write)
+        self.assertNotEqual(blob.path, blob_name(self.sha256, '.bin'))
+        self.assertTrue(default_storage.exists(blob.path))
+
+    def test_message_delete_releases_blob(self):
+        file = self.upload()
+        path = file.blob.path
+        message = Message.objects.create(sender=self.user, content='')
+        File.objects.filter(id=file.id).update(message=message)
+        with self.captureOnCommitCallbacks(execute=True):
+            message.delete()
+        self.assertFalse(Blob.objects.filter(id=file.blob_id).exists())
+        self.assertFalse(default_storage.exists(path))
+
+    def test_reupload_before_delete_keeps_blob(self):
+        file = self.upload()
+        with self.captureOnCommitCallbacks() as callbacks:
+            file.delete()
+        again = self.upload()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(again.blob_id, file.blob_id)
+        self.assertEqual(Blob.objects.get(id=again.blob_id).refcount, 1)
+        self.assertTrue(default_storage.exists(again.blob.path))
+        self.assertEqual(len(self.writes), 1)
+
+    def test_intact_leftover_is_reused(self):
+        name = default_storage.save(blob_name(self.sha256, '.bin'), ContentFile(self.data))
+        self.assertEqual(self.upload().blob.path, name)
+        self.assertEqual(self.writes, [])
+
+    def test_truncated_leftover_is_rewritten(self):
+        default_storage.save(blob_name(self.sha256, '.bin'), ContentFile(self.data[:4]))
+        file = self.upload()
+        self.assertEqual(len(self.writes), 1)
+        with default_storage.open(file.blob.path, 'rb') as stored:
+            self.assertEqual(stored.read(), self.data)
+
+    def test_gc_recounts_and_removes_unreferenced(self):
+        file = self.upload()
+        path = file.blob.path
+        # A worker that died before dropping its reference.
+        Blob.objects.filter(id=file.blob_id).update(refcount=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            file.delete()
+        self.assertTrue(Blob.objects.filter(id=file.blob_id).exists())
+        call_command('gc_blobs', '--min-age', '0', stdout=io.StringIO())
+        self.assertFalse(Blob.objects.filter(id=file.blob_id).exists())
+        self.assertFalse(default_storage.exists(path))
+
+    def test_processed_image_moves_blob_path(self):
+        file = self.upload('image/png', 'a.png')
+        original = default_storage.save('uploads/a_original.webp', ContentFile(b'variant'))
+        finish(file.id, Job(None, (), {'original': original}, 'image'),
+               result={'original': {'width': 4, 'height': 3, 'source': 'original'}})
+        blob = Blob.objects.get(id=file.blob_id)
+        self.assertEqual(blob.path, original)
+        self.assertEqual(File.objects.get(id=file.id).file.name, original)
+        self.assertFalse(default_storage.exists(blob_name(self.sha256, '.png')))
+        self.assertEqual(self.upload('image/png', 'a.png').file.name, original)
+
+
+def atom(kind, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+class MoovFirstTests(SimpleTestCase):
+    def moov_first(self, data):
+        with tempfile.NamedTemporaryFile(suffix='.mp4') as source:
+            source.write(data)
+            source.flush()
+            return transcoding.moov_first(source.name)
+
+    def test_index_before_media(self):
+        self.assertTrue(self.moov_first(atom(b'ftyp', b'isom') + atom(b'moov', b'x' * 20) + atom(b'mdat', b'y' * 50)))
+
+    def test_index_after_media(self):
+        self.assertFalse(self.moov_first(atom(b'ftyp', b'isom') + atom(b'mdat', b'y' * 50) + atom(b'moov', b'x' * 20)))
+
+    def test_large_size_atom_is_skipped(self):
+        free = struct.pack('>I4sQ', 1, b'free', 16 + 30) + b'z' * 30
+        self.assertTrue(self.moov_first(atom(b'ftyp', b'isom') + free + atom(b'moov')))
+
+    def test_malformed(self):
+        self.assertFalse(self.moov_first(b''))
+        self.assertFalse(self.moov_first(atom(b'ftyp', b'isom')[:6]))
+        self.assertFalse(self.moov_first(struct.pack('>I4s', 4, b'free') + atom(b'moov')))
+
+
+class PlaybackArgsTests(SimpleTestCase):
+    def info(self, **overrides):
+        return {'mp4': True, 'moov_first': True, 'width': 640, 'height': 360, 'bit_rate': 500_000, **overrides}
+
+    def test_faststart_only_remuxes_mp4_with_index_at_end(self):
+        self.assertIsNone(transcoding.playback_args('video', self.info(), 'faststart'))
+        self.assertIsNone(transcoding.playback_args('video', self.info(mp4=False, moov_first=False), 'faststart'))
+        args = transcoding.playback_args('video', self.info(moov_first=False), 'faststart')
+        self.assertEqual(args, ['-map', '0', '-c', 'copy', '-movflags', '+faststart'])
+
+    def test_compact_video(self):
+        self.assertIsNone(transcoding.playback_args('video', self.info(), 'compact'))
+        for info in (self.info(width=1920, height=1080), self.info(bit_rate=8_000_000), self.info(mp4=False)):
+            args = transcoding.playback_args('video', info, 'compact')
+            self.assertIn('libx264', args)
+            self.assertIn('+faststart', args)
+
+    def test_compact_audio(self):
+        self.assertIsNone(transcoding.playback_args('audio', self.info(bit_rate=128_000), 'compact'))
+        args = transcoding.playback_args('audio', self.info(bit_rate=320_000), 'compact')
+        self.assertEqual(args[:3], ['-map', '0:a:0', '-vn'])
+
+    def test_unknown_mode(self):
+        self.assertIsNone(transcoding.playback_args('video', self.info(moov_first=False), 'original'))
+
+
+@unittest.skipUnless(transcoding.available(), 'ffmpeg and ffprobe are not installed')
+class MediaVariantTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def fixture(self, name, *args):
+        path = os.path.join(self.directory, name)
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', *args, path], check=True, capture_output=True)
+        return path
+
+    def video(self):
+        # Plain MP4 muxing writes the index after the media data.
+        return self.fixture('clip.mp4', '-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=10:duration=2',
+                            '-f', 'lavfi', '-i', 'sine=frequency=440:duration=2', '-c:v', 'mpeg4', '-c:a', 'aac')
+
+    def targets(self, extension):
+        return {'poster': os.path.join(self.directory, 'poster.jpg'),
+                'playback': os.path.join(self.directory, f'playback.{extension}')}
+
+    def test_video_gets_poster_and_faststart_copy(self):
+        source = self.video()
+        self.assertFalse(transcoding.moov_first(source))
+        targets = self.targets('mp4')
+        metadata, variants = transcoding.make_media_variants(source, targets, 'video', 'faststart')
+        self.assertAlmostEqual(metadata['duration'], 2, delta=0.2)
+        self.assertEqual((metadata['width'], metadata['height']), (320, 240))
+        self.assertEqual((variants['poster']['width'], variants['poster']['height']), (320, 240))
+        self.assertEqual(variants['playback']['width'], 320)
+        self.assertTrue(transcoding.moov_first(targets['playback']))
+
+    def test_faststart_upload_is_left_alone(self):
+        source = self.fixture('fast.mp4', '-i', self.video(), '-c', 'copy', '-movflags', '+faststart')
+        _, variants = transcoding.make_media_variants(source, self.targets('mp4'), 'video', 'faststart')
+        self.assertNotIn('playback', variants)
+
+    def test_audio_without_cover_has_no_poster(self):
+        source = self.fixture('tone.wav', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=1')
+        targets = self.targets('m4a')
+        metadata, variants = transcoding.make_media_variants(source, targets, 'audio', 'compact')
+        self.assertAlmostEqual(metadata['duration'], 1, delta=0.2)
+        self.assertIsNone(metadata['width'])
+        self.assertNotIn('poster', variants)
+        self.assertTrue(transcoding.moov_first(targets['playback']))
+
+
+class HistoryPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reader')
+        peer = User.objects.create(username='peer')
+        other = User.objects.create(username='other')
+        self.ids = []
+        for number in range(8):
+            self.ids.append(Message.objects.create(sender=peer, recipient=self.user, content=str(number)).id)
+            Message.objects.create(sender=peer, recipient=other, content='not in scope')
+        self.scope = Q(sender_id=self.user.id) | Q(recipient_id=self.user.id)
+        # Archives everything up to the fourth message, and the out-of-scope rows between them.
+        archive_batch(self.ids[3])
+
+    def page(self, after_id=None, before_id=None, limit=3):
+        return [row['id'] for row in history_page(self.scope, after_id, before_id, limit)]
+
+    def test_after_reads_through_the_boundary(self):
+        self.assertEqual(self.page(after_id=self.ids[0], limit=2), self.ids[1:3])
+        self.assertEqual(self.page(after_id=self.ids[1]), self.ids[2:5])
+        self.assertEqual(self.page(after_id=self.ids[3]), self.ids[4:7])
+        self.assertEqual(self.page(after_id=self.ids[6]), self.ids[7:])
+
+    def test_before_reads_through_the_boundary(self):
+        self.assertEqual(self.page(before_id=self.ids[6]), self.ids[3:6])
+        self.assertEqual(self.page(before_id=self.ids[4]), self.ids[1:4])
+        self.assertEqual(self.page(before_id=self.ids[5], limit=10), self.ids[:5])
+
+    def test_newest_page(self):
+        self.assertEqual(self.page(), self.ids[5:])
+        self.assertEqual(self.page(limit=20), self.ids)
+
+    def test_boundary_is_not_cached_per_process(self):
+        cache.set(ARCHIVE_BOUNDARY_KEY, 0)
+        self.assertEqual(archive_boundary(), ArchivedMessage.objects.order_by('-id').first().id)
+        self.assertEqual(self.page(after_id=self.ids[2]), self.ids[3:6])
+
+    @override_settings(REDIS_URL='redis://shared')
+    def test_archiving_updates_shared_boundary(self):
+        archive_boundary()
+        archive_batch(self.ids[5])
+        self.assertEqual(cache.get(ARCHIVE_BOUNDARY_KEY), archive_boundary())
+        self.assertEqual(archive_boundary(), ArchivedMessage.objects.order_by('-id').first().id)
+        self.assertEqual(self.page(after_id=self.ids[4]), self.ids[5:8])
+
+
+class SerializeMessagesTests(TestCase):
+    def test_matches_message_serializer(self):
+        sender = User.objects.create(username='sender', description='hi')
+        recipient = User.objects.create(username='recipient')
+        group = Group.objects.create(name='group', creator=sender)
+        Message.objects.create(sender=sender, recipient=recipient, content='direct')
+        Message.objects.create(sender=recipient, group=group, content='to the group')
+        attached = Message.objects.create(sender=sender, recipient=recipient, content='')
+        File.objects.create(file='uploads/photo.jpg', file_type='image', message=attached, width=640, height=480,
+                            variants={'thumb': {'file': 'uploads/photo_thumb.webp', 'width': 320, 'height': 240}})
+        File.objects.create(file='uploads/clip.mp4', file_type='video', message=attached, status='processing')
+
+        messages = Message.objects.order_by('id')
+        expected = JSONRenderer().render(MessageSerializer(messages, many=True).data)
+        actual = JSONRenderer().render(serialize_messages(list(messages.values(*MESSAGE_ROW_FIELDS))))
+        self.assertEqual(actual, expected)
+
+
+class MessageSendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create(username='sender')
+        self.recipient = User.objects.create(username='recipient')
+        session = self.client.session
+        session['user_id'] = self.sender.id
+        session.save()
+
+    def post(self, data):
+        return self.client.post('/api/messages/', data, content_type='application/json')
+
+    def test_message_needs_a_conversation(self):
+        response = self.post({'content': 'hello'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+    def test_direct_message(self):
+        response = self.post({'content': 'hello', 'recipient_id': self.recipient.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Conversation.objects.filter(peer__isnull=False).count(), 2)
+
+    def test_only_own_unattached_files_can_be_attached(self):
+        own = File.objects.create(file='uploads/own.bin', file_type='other', uploader=self.sender)
+        theirs = File.objects.create(file='uploads/theirs.bin', file_type='other', uploader=self.recipient)
+        taken = Message.objects.create(sender=self.sender, recipient=self.recipient, content='')
+        sent = File.objects.create(file='uploads/sent.bin', file_type='other', uploader=self.sender, message=taken)
+
+        for file in (theirs, sent):
+            response = self.post({'recipient_id': self.recipient.id, 'file_ids': [own.id, file.id]})
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertIsNone(File.objects.get(id=own.id).message_id)
+        self.assertIsNone(File.objects.get(id=theirs.id).message_id)
+        self.assertEqual(File.objects.get(id=sent.id).message_id, taken.id)
+
+        response = self.post({'recipient_id': self.recipient.id, 'file_ids': [own.id]})
+        self.assertEqual([file['id'] for file in response.json()['message']['files']], [own.id])
+
+    def test_message_without_conversation_is_not_recorded(self):
+        message = Message.objects.create(sender=self.sender, content='orphan')
+        record_message(message)
+        self.assertFalse(Conversation.objects.exists())
+        fan_out({'id': message.id, 'sender': {'id': self.sender.id}, 'recipient': None, 'group': None})
+
+
+class MediaTests(TestCase):
+    data = b'0123456789'
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.uploader = User.objects.create(username='uploader')
+        self.reader = User.objects.create(username='reader')
+        self.stranger = User.objects.create(username='stranger')
+        self.name = default_storage.save('uploads/notes.txt', ContentFile(self.data))
+        self.file = File.objects.create(file=self.name, file_type='other', uploader=self.uploader)
+        session = self.client.session
+        session['user_id'] = self.uploader.id
+        session.save()
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=2-4', 10), (2, 4))
+        self.assertEqual(parse_range('bytes=7-', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=5-100', 10), (5, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=-30', 10), (0, 9))
+        self.assertIs(parse_range('bytes=-0', 10), False)
+        self.assertIs(parse_range('bytes=10-', 10), False)
+        self.assertIs(parse_range('bytes=4-2', 10), False)
+        self.assertIsNone(parse_range('bytes=0-1,4-5', 10))
+        self.assertIsNone(parse_range('items=0-1', 10))
+        self.assertIsNone(parse_range(None, 10))
+
+    def test_range_requests(self):
+        url = f'/media/{self.name}'
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 7-9/10')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_if_none_match(self):
+        url = f'/media/{self.name}'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_can_access(self):
+        self.assertTrue(can_access(self.uploader.id, self.name))
+        self.assertFalse(can_access(self.reader.id, self.name))
+        self.assertFalse(can_access(None, self.name))
+
+        message = Message.objects.create(sender=self.uploader, recipient=self.reader, content='')
+        File.objects.filter(id=self.file.id).update(message=message)
+        self.assertTrue(can_access(self.reader.id, self.name))
+        self.assertFalse(can_access(self.stranger.id, self.name))
+
+        group = Group.objects.create(name='group', creator=self.uploader)
+        group.members.add(self.stranger)
+        Message.objects.filter(id=message.id).update(recipient=None, group=group)
+        self.assertTrue(can_access(self.stranger.id, self.name))
+        self.assertFalse(can_access(self.reader.id, self.name))
+
+        session = self.client.session
+        session['user_id'] = self.reader.id
+        session.save()
+        self.assertEqual(self.client.get(f'/media/{self.name}').status_code, 404)
+
+
+class PresenceTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1_000_000.0
+        self.enterContext(mock.patch('time.time', lambda: self.now))
+        self.published = []
+        self.enterContext(mock.patch.object(presence, 'publish_presence',
+                                            lambda user_id, online: self.published.append((user_id, online))))
+
+    def test_heartbeat_keeps_user_online_for_ttl(self):
+        self.assertTrue(presence.heartbeat(1))
+        self.now += presence.HEARTBEAT_INTERVAL
+        self.assertFalse(presence.heartbeat(1))
+        self.now += presence.PRESENCE_TTL - 1
+        self.assertTrue(presence.is_online(1))
+        self.now += 2
+        self.assertFalse(presence.is_online(1))
+        self.assertEqual(self.published, [(1, True)])
+        self.assertTrue(presence.heartbeat(1))
+
+    def test_disconnect_keeps_key_for_grace_period(self):
+        presence.heartbeat(1)
+        presence.disconnect(1)
+        self.now += presence.DISCONNECT_GRACE - 1
+        self.assertEqual(presence.online([1, 2]), {1})
+        self.now += 2
+        self.assertEqual(presence.online([1, 2]), set())
+
+    def test_other_tab_renews_during_grace_period(self):
+        presence.heartbeat(1)
+        presence.disconnect(1)
+        self.now += presence.DISCONNECT_GRACE - 1
+        self.assertFalse(presence.heartbeat(1))
+        self.now += presence.DISCONNECT_GRACE
+        self.assertTrue(presence.is_online(1))
+
+    async def expire(self, renew=False):
+        async def sleep(seconds):
+            self.now += seconds / 2
+            if renew:
+                # Another tab's heartbeat while the closed one waits out the grace period.
+                presence.heartbeat(1)
+            self.now += seconds / 2
+        with mock.patch.object(presence.asyncio, 'sleep', sleep):
+            await presence.expire_after_disconnect(1)
+
+    async def test_expiry_announced_after_grace_period(self):
+        presence.heartbeat(1)
+        presence.disconnect(1)
+        await self.expire()
+        self.assertEqual(self.published, [(1, True), (1, False)])
+
+    async def test_renewed_connection_is_not_announced_offline(self):
+        presence.heartbeat(1)
+        presence.disconnect(1)
+        await self.expire(renew=True)
+        self.assertEqual(self.published, [(1, True)])
+
+
+class SignalThrottleTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.throttle = SignalThrottle(clock=lambda: self.now)
+
+    def test_repeat_within_window_is_dropped(self):
+        self.assertTrue(self.throttle.allow('user_2', 'typing'))
+        self.now += SIGNAL_REPEAT_INTERVAL - 0.1
+        self.assertFalse(self.throttle.allow('user_2', 'typing'))
+        self.assertTrue(self.throttle.allow('user_2', 'recording'))
+        self.assertTrue(self.throttle.allow('group_5', 'recording'))
+        self.now += SIGNAL_REPEAT_INTERVAL
+        self.assertTrue(self.throttle.allow('user_2', 'recording'))
+
+    def test_stop_only_after_start(self):
+        self.assertFalse(self.throttle.allow('user_2', 'stop'))
+        self.assertTrue(self.throttle.allow('user_2', 'typing'))
+        self.assertTrue(self.throttle.allow('user_2', 'stop'))
+        self.assertFalse(self.throttle.allow('user_2', 'stop'))
+        self.assertTrue(self.throttle.allow('user_2', 'typing'))
+
+    def test_token_bucket(self):
+        allowed = [self.throttle.allow(f'user_{target}', 'typing') for target in range(SIGNAL_BURST + 5)]
+        self.assertEqual(allowed.count(True), SIGNAL_BURST)
+        self.assertFalse(allowed[-1])
+        self.now += 1
+        refilled = [self.throttle.allow(f'group_{target}', 'typing') for target in range(SIGNAL_RATE + 1)]
+        self.assertEqual(refilled, [True] * SIGNAL_RATE + [False])
+
+    def test_drain_returns_started_targets(self):
+        self.throttle.allow('user_2', 'typing')
+        self.throttle.allow('group_5', 'recording')
+        self.throttle.allow('group_5', 'stop')
+        self.assertEqual(self.throttle.drain(), ['user_2'])
+        self.assertEqual(self.throttle.drain(), [])
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='owner', password='right password')
+
+    def login(self, password, address='10.0.0.1'):
+        return self.client.post('/api/users/', {'username': 'owner', 'password': password},
+                                content_type='application/json', REMOTE_ADDR=address)
+
+    def test_repeated_failures_from_one_address_are_refused(self):
+        for _ in range(passwords.FAILURE_LIMIT):
+            self.assertEqual(self.login('wrong').status_code, 401)
+        response = self.login('right password')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(passwords.FAILURE_WINDOW))
+        self.assertEqual(self.login('right password', '10.0.0.2').status_code, 200)
+
+    @mock.patch.object(passwords, 'ACCOUNT_FAILURE_LIMIT', 3)
+    def test_failures_from_many_addresses_do_not_lock_out(self):
+        for number in range(passwords.ACCOUNT_FAILURE_LIMIT):
+            self.assertEqual(self.login('wrong', f'10.1.0.{number}').status_code, 401)
+        slept = []
+
+        async def sleep(seconds):
+            slept.append(seconds)
+        with mock.patch.object(passwords.asyncio, 'sleep', sleep):
+            self.assertEqual(self.login('right password').status_code, 200)
+        self.assertEqual(slept, [passwords.ACCOUNT_FAILURE_DELAY])
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        User.objects.filter(id=self.user.id).update(password=make_password('right password', hasher='pbkdf2_sha1'))
+        self.assertEqual(self.login('right password').status_code, 200)
+        upgraded = User.objects.get(id=self.user.id).password
+        self.assertEqual(identify_hasher(upgraded).algorithm, get_hasher('default').algorithm)
+        self.assertEqual(self.login('right password').status_code, 200)
+
+
+class GroupAccessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='member')
+        self.group = Group.objects.create(name='group', creator=self.user)
+        self.group.members.add(self.user)
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session.save()
+
+    def test_removed_member_is_refused_despite_cached_members(self):
+        self.assertIn(self.user.id, group_member_ids(self.group.id))
+        # Removed through another worker, whose invalidation never reached this cache.
+        Group.members.through.objects.filter(group_id=self.group.id, user_id=self.user.id).delete()
+        self.assertEqual(self.client.get('/api/messages/', {'group_id': self.group.id}).status_code, 403)
+        self.assertEqual(self.client.get(f'/api/groups/{self.group.id}/members/').status_code, 403)
+        response = self.client.post('/api/messages/', {'group_id': self.group.id, 'content': 'hi'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_current_user(self):
+        self.assertEqual(self.client.get('/api/users/current/').json()['username'], 'member')
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get('/api/users/current/').status_code, 401)
+
+
+class MessageEndpointTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reader')
+        self.peer = User.objects.create(username='peer')
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session.save()
+        self.message = Message.objects.create(sender=self.peer, recipient=self.user, content='hello')
+        record_message(self.message)
+
+    def test_long_poll_returns_waiting_messages_at_once(self):
+        newer = Message.objects.create(sender=self.peer, recipient=self.user, content='again')
+        response = self.client.get('/api/messages/', {'recipient_id': self.peer.id, 'after': self.message.id,
+                                                       'wait': 5})
+        self.assertEqual([message['id'] for message in response.json()], [newer.id])
+
+    def test_wait_is_ignored_under_wsgi(self):
+        started = time.monotonic()
+        response = self.client.get('/api/messages/', {'recipient_id': self.peer.id, 'after': self.message.id,
+                                                       'wait': 5})
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(response.json(), [])
+        self.assertNotIn('X-Long-Poll', response)
+
+    def test_other_methods_are_not_allowed(self):
+        self.assertEqual(self.client.put('/api/messages/').status_code, 405)
+
+    def test_seen_marks_read(self):
+        response = self.client.post('/api/messages/seen/', {'recipient_id': self.peer.id},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['message_ids'], [self.message.id])
+        self.assertIsNotNone(Message.objects.get(id=self.message.id).read_at)
+
+    def test_chatted_users(self):
+        users = self.client.get('/api/users/chatted/').json()['users']
+        self.assertEqual([user['id'] for user in users], [self.peer.id])
+
+
+class LongPollTests(TransactionTestCase):
+    """Long polls served under ASGI; each request gets its own database thread, so rows must be committed."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reader')
+        self.peer = User.objects.create(username='peer')
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session.save()
+        self.message = Message.objects.create(sender=self.peer, recipient=self.user, content='hello')
+        record_message(self.message)
+
+    async def long_poll(self, wait, during):
+        self.async_client.cookies['sessionid'] = self.client.cookies['sessionid'].value
+        task = asyncio.create_task(during())
+        response = await self.async_client.get(
+            '/api/messages/', {'recipient_id': self.peer.id, 'after': self.message.id, 'wait': wait}
+        )
+        await task
+        return response
+
+    async def test_long_poll_wakes_on_new_message(self):
+        async def send():
+            await asyncio.sleep(0.2)
+            # As another worker would: the row, then a push through the channel layer.
+            newer = await Message.objects.acreate(sender=self.peer, recipient=self.user, content='again')
+            await get_channel_layer().group_send(user_group_name(self.user.id),
+                                                 {'type': 'message.new', 'message': {'id': newer.id}})
+            return newer
+
+        started = time.monotonic()
+        response = await self.long_poll(5, send)
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertEqual(response['X-Long-Poll'], '1')
+        self.assertEqual([message['content'] for message in response.json()], ['again'])
+
+    async def test_long_poll_sleeps_through_other_events(self):
+        async def signal():
+            await asyncio.sleep(0.1)
+            await get_channel_layer().group_send(user_group_name(self.user.id), {'type': 'signal', 'kind': 'typing'})
+
+        started = time.monotonic()
+        response = await self.long_poll(0.5, signal)
+        self.assertGreaterEqual(time.monotonic() - started, 0.5)
+        self.assertEqual(response.json(), [])
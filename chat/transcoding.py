@@ -0,0 +1,172 @@
+from PIL import Image
+import json
+import os
+import shutil
+import struct
+import subprocess
+
+# Runs inside media worker processes like imaging: paths and tool names come
+# in as arguments, so nothing here may touch Django models or settings.
+
+PROBE_TIMEOUT = 60
+TRANSCODE_TIMEOUT = 30 * 60
+POSTER_MAX_EDGE = 1280
+# "compact" renditions: at most 720p-ish (longest edge 1280) and about 2 Mbit/s.
+COMPACT_MAX_EDGE = 1280
+COMPACT_VIDEO_BITRATE = 2_000_000
+COMPACT_AUDIO_BITRATE = 96_000
+PLAYBACK_EXTENSIONS = {
+    'video': 'mp4',
+    'audio': 'm4a',
+}
+POSTER_EXTENSION = 'jpg'
+RENDITION_MODES = ('faststart', 'compact')
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def available(ffmpeg='ffmpeg', ffprobe='ffprobe'):
+    return bool(shutil.which(ffmpeg) and shutil.which(ffprobe))
+
+
+def run(args, timeout):
+    completed = subprocess.run(args, stdin=subprocess.DEVNULL, capture_output=True, timeout=timeout)
+    if completed.returncode:
+        stderr = completed.stderr.decode(errors='replace').strip().splitlines()
+        raise TranscodeError(f"{os.path.basename(args[0])} exited with {completed.returncode}: {' '.join(stderr[-3:])}")
+    return completed.stdout
+
+
+def rotation(stream):
+    """Display rotation in degrees; phones store portrait video as rotated landscape."""
+    if 'rotate' in stream.get('tags', {}):
+        return int(float(stream['tags']['rotate']))
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            return int(float(side_data['rotation']))
+    return 0
+
+
+def probe(path, ffprobe='ffprobe'):
+    """Duration and display size of a media file as ffprobe sees it."""
+    info = json.loads(run([
+        ffprobe, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path
+    ], PROBE_TIMEOUT))
+    streams = info.get('streams', [])
+    container = info.get('format', {})
+    video = cover = audio = None
+    for stream in streams:
+        if stream.get('codec_type') == 'video':
+            # Cover art in audio files shows up as a single-frame "attached picture" stream.
+            if stream.get('disposition', {}).get('attached_pic'):
+                cover = cover or stream
+            else:
+                video = video or stream
+        elif stream.get('codec_type') == 'audio':
+            audio = audio or stream
+
+    width = height = None
+    if video and video.get('width') and video.get('height'):
+        width, height = int(video['width']), int(video['height'])
+        if rotation(video) % 180:
+            width, height = height, width
+    duration = container.get('duration') or (video or audio or {}).get('duration')
+    return {
+        'duration': round(float(duration), 3) if duration else None,
+        'width': width,
+        'height': height,
+        'bit_rate': int(container['bit_rate']) if container.get('bit_rate') else None,
+        'mp4': 'mp4' in container.get('format_name', '').split(','),
+        'has_video': video is not None,
+        'has_cover': cover is not None,
+        'has_audio': audio is not None,
+    }
+
+
+def moov_first(path):
+    """Whether an MP4 file already has its index ahead of the media data, so playback can start early."""
+    with open(path, 'rb') as source:
+        while True:
+            header = source.read(8)
+            if len(header) < 8:
+                return False
+            size, kind = struct.unpack('>I4s', header)
+            if kind == b'moov':
+                return True
+            if kind == b'mdat':
+                return False
+            if size == 1:
+                size = struct.unpack('>Q', source.read(8))[0] - 8
+            elif size < 8:
+                return False
+            source.seek(size - 8, os.SEEK_CUR)
+
+
+def fit_filter(max_edge):
+    # Only ever shrink, keep the aspect ratio, and keep both sides even for H.264.
+    return (f"scale=w='min(iw,{max_edge})':h='min(ih,{max_edge})'"
+            f":force_original_aspect_ratio=decrease:force_divisible_by=2")
+
+
+def extract_poster(source_path, target, info, ffmpeg='ffmpeg'):
+    """Write a still for the player: a frame a second in (or mid-way for short clips), or the cover art."""
+    seek = []
+    if info['has_video'] and info['duration']:
+        seek = ['-ss', f"{min(1.0, info['duration'] / 2):.3f}"]
+    run([
+        ffmpeg, '-v', 'error', '-y', *seek, '-i', source_path, '-map', '0:v:0', '-frames:v', '1',
+        '-vf', fit_filter(POSTER_MAX_EDGE), '-q:v', '4', '-f', 'image2', target
+    ], TRANSCODE_TIMEOUT)
+    with Image.open(target) as img:
+        return img.size
+
+
+def playback_args(file_type, info, mode):
+    """ffmpeg output options for a rendition, or None when the upload already plays well as it is."""
+    if mode == 'faststart':
+        # A lossless remux; only MP4 can be fixed this way and only if the index is at the end.
+        if not info['mp4'] or info['moov_first']:
+            return None
+        return ['-map', '0', '-c', 'copy', '-movflags', '+faststart']
+    if mode != 'compact':
+        return None
+    if file_type == 'video':
+        small = max(info['width'] or 0, info['height'] or 0) <= COMPACT_MAX_EDGE
+        if small and info['mp4'] and info['moov_first'] and (info['bit_rate'] or 0) <= COMPACT_VIDEO_BITRATE + COMPACT_AUDIO_BITRATE:
+            return None
+        return [
+            '-map', '0:v:0', '-map', '0:a:0?', '-vf', fit_filter(COMPACT_MAX_EDGE),
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '28', '-pix_fmt', 'yuv420p',
+            '-maxrate', str(COMPACT_VIDEO_BITRATE), '-bufsize', str(2 * COMPACT_VIDEO_BITRATE),
+            '-c:a', 'aac', '-b:a', str(COMPACT_AUDIO_BITRATE), '-movflags', '+faststart',
+        ]
+    if (info['bit_rate'] or 0) <= COMPACT_AUDIO_BITRATE * 3 // 2 and info['mp4'] and info['moov_first']:
+        return None
+    return ['-map', '0:a:0', '-vn', '-c:a', 'aac', '-b:a', str(COMPACT_AUDIO_BITRATE), '-movflags', '+faststart']
+
+
+def make_media_variants(source_path, targets, file_type, mode, ffmpeg='ffmpeg', ffprobe='ffprobe'):
+    """Probe a video or audio upload and write the variants in ``targets`` that apply to it.
+
+    ``targets`` maps ``poster`` and ``playback`` to output paths. Returns
+    ``(metadata, variants)`` where metadata holds duration and display size
+    and variants has the same shape as ``imaging.make_variants`` returns.
+    """
+    info = probe(source_path, ffprobe)
+    info['moov_first'] = info['mp4'] and moov_first(source_path)
+    variants = {}
+    if 'poster' in targets and (info['has_video'] or info['has_cover']):
+        width, height = extract_poster(source_path, targets['poster'], info, ffmpeg)
+        variants['poster'] = {'width': width, 'height': height, 'source': 'poster'}
+
+    args = playback_args(file_type, info, mode) if 'playback' in targets else None
+    if args is not None:
+        run([ffmpeg, '-v', 'error', '-y', '-i', source_path, *args, '-f', 'mp4', targets['playback']],
+            TRANSCODE_TIMEOUT)
+        rendition = probe(targets['playback'], ffprobe)
+        variants['playback'] = {'width': rendition['width'], 'height': rendition['height'], 'source': 'playback'}
+
+    metadata = {'duration': info['duration'], 'width': info['width'], 'height': info['height']}
+    return metadata, variants
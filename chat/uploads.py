@@ -0,0 +1,259 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from .models import File, UploadSession
+from .blobs import store_blob
+from .tasks import enqueue_file, needs_processing
+import hashlib
+import os
+import re
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: lock a byte past the largest allowed upload, so reads of the data are never blocked.
+    fcntl = None
+    import msvcrt
+
+MAX_UPLOAD_SIZE = 20 * 1024 * 1024 * 1024
+READ_BLOCK_SIZE = 1024 * 1024
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not start where the upload currently ends."""
+
+    def __init__(self, offset):
+        super().__init__(offset)
+        self.offset = offset
+
+
+class IncompleteChunk(UploadError):
+    """The client sent fewer bytes than its Content-Range promised."""
+
+
+class ChecksumMismatch(UploadError):
+    pass
+
+
+class AlreadyCommitted(UploadError):
+    """Another request turned the upload into a File first."""
+
+    def __init__(self, file_id):
+        super().__init__(file_id)
+        self.file_id = file_id
+
+
+def upload_name(filename):
+    extension = os.path.splitext(filename)[1]
+    return os.path.join('uploads', f"{timezone.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:12]}{extension}")
+
+
+def file_type_for(content_type):
+    for file_type in ('image', 'video', 'audio'):
+        if (content_type or '').startswith(file_type):
+            return file_type
+    return 'other'
+
+
+def store_upload(sha256, size, filename, content_type, write):
+    """The Blob holding these bytes, written through ``write(name)`` only if nobody stored them before.
+
+    ``write`` returns the name it stored the bytes under.
+    """
+    status = 'processing' if needs_processing(file_type_for(content_type)) else 'ready'
+    return store_blob(sha256, size, os.path.splitext(filename)[1], status, write)
+
+
+def create_file(blob, created, content_type, uploader_id):
+    """Register an upload backed by ``blob``; new media stays ``processing`` until the media queue is done."""
+    file_type = file_type_for(content_type)
+    file = File.objects.create(
+        file=blob.variants.get('original', {}).get('file', blob.path), blob=blob, file_type=file_type,
+        uploader_id=uploader_id, status=blob.status if file_type != 'other' else 'ready', variants=blob.variants,
+        duration=blob.duration, width=blob.width, height=blob.height
+    )
+    # Content seen before was already processed, or is being processed for its first File.
+    if created and file.status == 'processing':
+        enqueue_file(file.id)
+    return file
+
+
+def move_into(source, name):
+    target = default_storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(default_storage.path(source), target)
+    return name
+
+
+class HasherCache:
+    """Running SHA-256 states of in-progress uploads, keyed by session id.
+
+    hashlib objects cannot be stored in the database, so they live here and
+    a session that lands on another worker (or after a restart) rehashes the
+    bytes already on disk, a block at a time, before continuing.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def take(self, session):
+        with self._lock:
+            entry = self._entries.pop(session.id, None)
+        if entry and entry[0] == session.received:
+            return entry[1]
+        hasher = hashlib.sha256()
+        remaining = session.received
+        with default_storage.open(session.path, 'rb') as stored:
+            while remaining:
+                block = stored.read(min(READ_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+        return hasher
+
+    def put(self, session_id, offset, hasher):
+        with self._lock:
+            self._entries[session_id] = (offset, hasher)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def drop(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+hashers = HasherCache()
+
+
+def parse_content_range(header):
+    """(start, end) of a ``bytes start-end/total`` header, or None when it is malformed."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        return None
+    start, end, total = map(int, match.groups())
+    if start > end or end >= total:
+        return None
+    return start, end
+
+
+def start_upload(user_id, filename, size, content_type):
+    # Saving an empty file reserves the final name; chunks are appended to it in place.
+    path = default_storage.save(upload_name(filename), ContentFile(b''))
+    return UploadSession.objects.create(
+        user_id=user_id, filename=filename[:255], content_type=content_type[:100], path=path, size=size
+    )
+
+
+@contextmanager
+def locked_upload(session):
+    """The upload's file opened for writing, held exclusively by this request until the block exits.
+
+    The lock is on the file rather than the session row, so a chunk that a slow
+    client takes minutes to send doesn't hold a database lock (all of SQLite,
+    with IMMEDIATE transactions) meanwhile.
+    """
+    with open(default_storage.path(session.path), 'r+b') as target:
+        if fcntl:
+            fcntl.flock(target, fcntl.LOCK_EX)
+            yield target
+            return
+        target.seek(MAX_UPLOAD_SIZE)
+        while True:
+            try:
+                msvcrt.locking(target.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                # LK_LOCK gives up after about ten seconds; a chunk can take longer than that.
+                continue
+        try:
+            yield target
+        finally:
+            target.seek(MAX_UPLOAD_SIZE)
+            msvcrt.locking(target.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_chunk(session, start, length, stream):
+    """Append ``length`` bytes from ``stream`` at ``start`` and return the new offset.
+
+    Whatever arrived before a disconnect is kept, so the client resumes from
+    the offset reported by GET instead of resending the whole chunk.
+    """
+    with locked_upload(session) as target:
+        # A retry that overlapped an earlier attempt waits for it and then sees where it ended.
+        session.refresh_from_db(fields=['received'])
+        if start != session.received:
+            raise OffsetMismatch(session.received)
+        if start + length > session.size:
+            raise UploadError('chunk exceeds the declared size')
+
+        hasher = hashers.take(session)
+        written = 0
+        target.seek(start)
+        # Drop any tail left by an earlier chunk that was never acknowledged.
+        target.truncate()
+        while written < length:
+            block = stream.read(min(READ_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            target.write(block)
+            hasher.update(block)
+            written += len(block)
+        target.flush()
+
+        offset = start + written
+        UploadSession.objects.filter(id=session.id).update(received=offset, updated_at=timezone.now())
+        session.received = offset
+        hashers.put(session.id, offset, hasher)
+    if written != length:
+        raise IncompleteChunk(offset)
+    return offset
+
+
+def commit_upload(session, sha256=None):
+    """Turn a fully received upload into a File, checking the client's digest when it sent one.
+
+    The session row stays locked until the File is saved, so a second commit
+    of the same upload waits and then gets ``AlreadyCommitted`` instead of
+    finding the received bytes already moved away.
+    """
+    with transaction.atomic():
+        locked = UploadSession.objects.select_for_update().get(id=session.id)
+        if locked.file_id:
+            raise AlreadyCommitted(locked.file_id)
+        session.received = locked.received
+        if session.received != session.size:
+            raise OffsetMismatch(session.received)
+        digest = hashers.take(session).hexdigest()
+        hashers.drop(session.id)
+        if sha256 and sha256.lower() != digest:
+            raise ChecksumMismatch(digest)
+
+        # The received bytes become the blob by rename; a duplicate is simply discarded.
+        blob, created = store_upload(digest, session.size, session.filename, session.content_type,
+                                     lambda name: move_into(session.path, name))
+        if default_storage.exists(session.path):
+            default_storage.delete(session.path)
+        session.file = create_file(blob, created, session.content_type, session.user_id)
+        session.save(update_fields=['file', 'updated_at'])
+    return session.file, digest
+
+
+def abort_upload(session):
+    hashers.drop(session.id)
+    if not session.file_id and default_storage.exists(session.path):
+        default_storage.delete(session.path)
+    session.delete()
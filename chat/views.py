@@ -1,80 +1,168 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.contrib.admin.views.decorators import staff_member_required
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework import status
-from .models import User, Group, Message, File
-from .serializers import UserSerializer, GroupSerializer, MessageSerializer, FileSerializer
-import os
-from django.conf import settings
+from .models import User, Group, Message, File, Conversation, UploadSession
+from .serializers import UserSerializer, GroupListSerializer, MessageSerializer, ConversationSerializer, MESSAGE_ROW_FIELDS, serialize_messages
+from .cache import chatted_users_cache, group_members_cache
+from .conversations import PREVIEW_LENGTH, mark_read, record_message, record_edit, record_delete, join_group_conversation
+from .uploads import MAX_UPLOAD_SIZE, UploadError, OffsetMismatch, IncompleteChunk, ChecksumMismatch, AlreadyCommitted, store_upload, create_file, parse_content_range, start_upload, write_chunk, commit_upload, abort_upload
+from .blobs import hash_file, release_blob
+from .search import TYPEAHEAD_LIMIT, search_messages, typeahead, index_user, index_group
+from .presence import heartbeat, go_offline, online, annotate_online, mark_online
+from .fanout import fan_out, metrics as fanout_metrics
+from .realtime import publish_seen, subscribe_group, listen, user_group_name, chat_group_name
+from .archive import history_page
+from .passwords import hash_password, ahash_password, login_throttle, join_throttle, FAILURE_WINDOW
+from asgiref.sync import sync_to_async
 from django.core.files.storage import default_storage
 import django.db.models as models
+from django.db import transaction
+from django.db.models.functions import Left
 from django.utils import timezone
-from django.core.cache import cache
-from PIL import Image
+import asyncio
+import json
 import logging
-import random
 
 logger = logging.getLogger(__name__)
 
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_PAGE_MAX_SIZE = 100
+LONG_POLL_MAX_WAIT = 30
+MEMBER_PAGE_SIZE = 50
+MEMBER_PAGE_MAX_SIZE = 200
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX_SIZE = 50
+PRESENCE_LOOKUP_MAX = 200
+
 def index(request):
     return render(request, 'index.html')
 
-class UserView(APIView):
-    def post(self, request):
-        data = request.data
-        username = data.get('username')
-        display_name = data.get('display_name')
-        password = data.get('password')
+@staff_member_required
+def fanout_stats(request):
+    """Fan-out latency by audience size for the process serving the request."""
+    return JsonResponse({'fanout': fanout_metrics.snapshot()})
 
-        if not username or not password:
-            return Response(
-                {'status': 'error', 'message': 'نام کاربری و رمز عبور الزامی است'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        user = User.objects.filter(username=username).first()
-        if user:
-            if user.check_password(password):
-                request.session['user_id'] = user.id
-                user.is_online = True
-                user.last_login = timezone.now()
-                user.save()
-                return Response({
-                    'status': 'success',
-                    'user_id': user.id,
-                    'username': user.username,
-                    'display_name': user.display_name,
-                    'profile_image': user.profile_image.url if user.profile_image else None,
-                    'description': user.description or ''
-                })
-            else:
-                return Response(
-                    {'status': 'error', 'message': 'رمز عبور اشتباه است'},
-                    status=status.HTTP_401_UNAUTHORIZED
-                )
+def api_response(data, status=status.HTTP_200_OK):
+    """JSON rendered the way DRF's Response renders it, for the async views that don't go through APIView."""
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
 
-        user = User(username=username, display_name=display_name or username)
-        user.set_password(password)
-        user.is_online = True
-        user.save()
-        request.session['user_id'] = user.id
-        return Response({
-            'status': 'success',
-            'user_id': user.id,
-            'username': user.username,
-            'display_name': user.display_name,
-            'profile_image': user.profile_image.url if user.profile_image else None,
-            'description': user.description or ''
-        })
+def request_data(request):
+    """Body of a JSON or form POST, for views that don't go through DRF's parsers."""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+    return request.POST
+
+def throttled_response():
+    response = api_response(
+        {'status': 'error', 'message': 'تلاش‌های ناموفق زیادی انجام شده است؛ چند دقیقه دیگر دوباره تلاش کنید'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(FAILURE_WINDOW)
+    return response
+
+def is_group_member(group_id, user_id):
+    """Membership for access checks, read from the database on the (group, user) unique index.
+
+    The cached member list is only for fan-out: it can lag behind a change made
+    through another worker's cache, which is fine for delivery but not here.
+    """
+    return Group.members.through.objects.filter(group_id=group_id, user_id=user_id).exists()
+
+async def ais_group_member(group_id, user_id):
+    return await Group.members.through.objects.filter(group_id=group_id, user_id=user_id).aexists()
+
+def add_group_member(group_id, user_id):
+    Group.members.through.objects.create(group_id=group_id, user_id=user_id)
+    group_members_cache.invalidate(group_id)
+    join_group_conversation(user_id, group_id)
+    subscribe_group(user_id, group_id)
+
+def annotate_group_list(groups):
+    """Member count and last message for a group list, computed in the same query."""
+    latest = Message.objects.filter(group_id=models.OuterRef('pk')).order_by('-id')
+    return groups.annotate(
+        member_count=models.Count('members'),
+        last_message_id=models.Subquery(latest.values('id')[:1]),
+        last_message_content=models.Subquery(
+            latest.annotate(preview=Left('content', PREVIEW_LENGTH)).values('preview')[:1]
+        ),
+        last_message_at=models.Subquery(latest.values('timestamp')[:1]),
+    ).order_by('id')
 
+class UserView(APIView):
     def get(self, request):
         query = request.GET.get('search', '')
-        users = User.objects.filter(username__icontains=query).exclude(id=request.session.get('user_id'))
-        serializer = UserSerializer(users, many=True)
+        # One spare id makes up for the current user being left out.
+        ids = [user_id for user_id in typeahead('user', query, TYPEAHEAD_LIMIT + 1)
+               if user_id != request.session.get('user_id')][:TYPEAHEAD_LIMIT]
+        users = User.objects.in_bulk(ids)
+        serializer = UserSerializer([users[user_id] for user_id in ids if user_id in users], many=True)
         return Response({'users': serializer.data})
 
+def user_payload(user):
+    return {
+        'status': 'success',
+        'user_id': user.id,
+        'username': user.username,
+        'display_name': user.display_name,
+        'profile_image': user.profile_image.url if user.profile_image else None,
+        'description': user.description or ''
+    }
+
+@csrf_exempt
+async def user_list(request):
+    """Entry point for /api/users/; a POST logs in (or signs up) and awaits the password hash off-thread."""
+    if request.method != 'POST':
+        return await sync_to_async(UserView.as_view())(request)
+
+    data = request_data(request)
+    username = data.get('username')
+    display_name = data.get('display_name')
+    password = data.get('password')
+
+    if not username or not password:
+        return api_response(
+            {'status': 'error', 'message': 'نام کاربری و رمز عبور الزامی است'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    user = await User.objects.filter(username=username).afirst()
+    if user:
+        address = request.META.get('REMOTE_ADDR', '')
+        if await login_throttle.blocked(user.id, address):
+            return throttled_response()
+        if not await user.acheck_password(password):
+            await login_throttle.failed(user.id, address)
+            return api_response(
+                {'status': 'error', 'message': 'رمز عبور اشتباه است'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        await login_throttle.succeeded(user.id, address)
+        await request.session.aset('user_id', user.id)
+        # Only the login time is written; presence lives in the cache.
+        await User.objects.filter(id=user.id).aupdate(last_login=timezone.now())
+        await sync_to_async(heartbeat)(user.id)
+        return api_response(user_payload(user))
+
+    user = User(username=username, display_name=display_name or username)
+    user.password = await ahash_password(password)
+    await user.asave()
+    await sync_to_async(index_user)(user)
+    await request.session.aset('user_id', user.id)
+    await sync_to_async(heartbeat)(user.id)
+    return api_response(user_payload(user))
+
 class UserDetailView(APIView):
     def get(self, request, pk):
         user = get_object_or_404(User, pk=pk)
@@ -83,24 +171,22 @@ class UserDetailView(APIView):
 
 class UserCurrentView(APIView):
     def get(self, request):
-        user_id = request.session.get('user_id')
-        if not user_id:
+        user = request.chat_user
+        if not user:
             return Response(
                 {'status': 'error', 'message': 'کاربر وارد نشده است'},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        user = get_object_or_404(User, id=user_id)
         serializer = UserSerializer(user)
         return Response(serializer.data)
 
     def patch(self, request):
-        user_id = request.session.get('user_id')
-        if not user_id:
+        user = request.chat_user
+        if not user:
             return Response(
                 {'status': 'error', 'message': 'کاربر وارد نشده است'},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        user = get_object_or_404(User, id=user_id)
 
         if 'profile_image' in request.FILES:
             if user.profile_image:
@@ -127,6 +213,8 @@ class UserCurrentView(APIView):
         if description:
             user.description = description
         user.save()
+        if username or display_name:
+            index_user(user)
         return Response({
             'status': 'success',
             'username': user.username,
@@ -144,26 +232,26 @@ class UserChattedView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
-        cache_key = f'chatted_users_{user_id}'
-        cached_users = cache.get(cache_key)
-        if cached_users:
-            return Response({'users': cached_users})
+        def load():
+            contacts = Conversation.objects.filter(user_id=user_id, peer__isnull=False).select_related('peer').order_by('-last_message_id')
+            return UserSerializer([contact.peer for contact in contacts], many=True).data
 
-        sent_messages = Message.objects.filter(sender_id=user_id).values('recipient_id').distinct()
-        received_messages = Message.objects.filter(recipient_id=user_id).values('sender_id').distinct()
+        # Presence changes far more often than the contact list, so it is never served from the cache.
+        return Response({'users': mark_online(chatted_users_cache.get_or_set(user_id, load))})
 
-        user_ids = set()
-        for msg in sent_messages:
-            if msg['recipient_id']:
-                user_ids.add(msg['recipient_id'])
-        for msg in received_messages:
-            if msg['sender_id']:
-                user_ids.add(msg['sender_id'])
+class ConversationView(APIView):
+    def get(self, request):
+        user_id = request.session.get('user_id')
+        if not user_id:
+            return Response(
+                {'status': 'error', 'message': 'کاربر وارد نشده است'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
 
-        users = User.objects.filter(id__in=user_ids)
-        serializer = UserSerializer(users, many=True)
-        cache.set(cache_key, serializer.data, timeout=60*15)
-        return Response({'users': serializer.data})
+        conversations = list(Conversation.objects.filter(user_id=user_id).select_related('peer', 'group').order_by('-last_message_id'))
+        annotate_online([conversation.peer for conversation in conversations if conversation.peer])
+        serializer = ConversationSerializer(conversations, many=True)
+        return Response({'conversations': serializer.data})
 
 class GroupView(APIView):
     def get(self, request):
@@ -174,14 +262,10 @@ class GroupView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
-        cache_key = f'groups_{user_id}'
-        cached_groups = cache.get(cache_key)
-        if cached_groups:
-            return Response(cached_groups)
-
-        groups = Group.objects.filter(members__id=user_id)
-        serializer = GroupSerializer(groups, many=True)
-        cache.set(cache_key, serializer.data, timeout=60*15)
+        groups = annotate_group_list(Group.objects.filter(
+            id__in=Group.members.through.objects.filter(user_id=user_id).values('group_id')
+        ))
+        serializer = GroupListSerializer(groups, many=True)
         return Response(serializer.data)
 
     def post(self, request):
@@ -204,12 +288,14 @@ class GroupView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        group = Group(name=name, description=description, password=password, creator_id=user_id)
+        group = Group(name=name, description=description, creator_id=user_id)
+        if password:
+            group.password = hash_password(password)
         if image:
             group.image = image
         group.save()
-        group.members.add(user_id)
-        cache.delete(f'groups_{user_id}')
+        index_group(group)
+        add_group_member(group.id, user_id)
         return Response({'status': 'success', 'group_id': group.id})
 
 class GroupDetailView(APIView):
@@ -220,45 +306,94 @@ class GroupDetailView(APIView):
                 {'status': 'error', 'message': 'کاربر وارد نشده است'},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        group = get_object_or_404(Group, pk=pk, members__id=user_id)
-        serializer = GroupSerializer(group)
+        groups = annotate_group_list(Group.objects.filter(
+            id__in=Group.members.through.objects.filter(user_id=user_id).values('group_id')
+        ))
+        group = get_object_or_404(groups, pk=pk)
+        serializer = GroupListSerializer(group)
         return Response(serializer.data)
 
-class GroupSearchView(APIView):
-    def get(self, request):
-        query = request.GET.get('search', '')
-        groups = Group.objects.filter(name__icontains=query)
-        serializer = GroupSerializer(groups, many=True)
-        return Response({'groups': serializer.data})
-
-class GroupJoinView(APIView):
-    def post(self, request):
+class GroupMemberView(APIView):
+    def get(self, request, pk):
         user_id = request.session.get('user_id')
         if not user_id:
             return Response(
                 {'status': 'error', 'message': 'کاربر وارد نشده است'},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-
-        group_id = request.data.get('group_id')
-        password = request.data.get('password', '')
-
-        group = get_object_or_404(Group, id=group_id)
-        if group.password and not group.check_password(password):
+        if not is_group_member(pk, user_id):
             return Response(
-                {'status': 'error', 'message': 'رمز عبور اشتباه است'},
-                status=status.HTTP_401_UNAUTHORIZED
+                {'status': 'error', 'message': 'شما عضو این گروه نیستید'},
+                status=status.HTTP_403_FORBIDDEN
             )
 
-        if group.members.filter(id=user_id).exists():
+        try:
+            after_id = int(request.GET.get('after', '0'))
+            limit = min(max(int(request.GET.get('limit', MEMBER_PAGE_SIZE)), 1), MEMBER_PAGE_MAX_SIZE)
+        except ValueError:
             return Response(
-                {'status': 'error', 'message': 'شما قبلاً عضو این گروه هستید'},
+                {'status': 'error', 'message': 'شناسه کاربر نامعتبر است'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        group.members.add(user_id)
-        cache.delete(f'groups_{user_id}')
-        return Response({'status': 'success', 'group_id': group.id})
+        members = list(User.objects.filter(groups__id=pk, id__gt=after_id).order_by('id')[:limit])
+        serializer = UserSerializer(members, many=True)
+        return Response({
+            'members': serializer.data,
+            'next': members[-1].id if len(members) == limit else None,
+        })
+
+class GroupSearchView(APIView):
+    def get(self, request):
+        query = request.GET.get('search', '')
+        ids = typeahead('group', query)
+        groups = annotate_group_list(Group.objects.filter(id__in=ids)).in_bulk()
+        serializer = GroupListSerializer([groups[group_id] for group_id in ids if group_id in groups], many=True)
+        return Response({'groups': serializer.data})
+
+@csrf_exempt
+@require_POST
+async def group_join(request):
+    user_id = await request.session.aget('user_id')
+    if not user_id:
+        return api_response(
+            {'status': 'error', 'message': 'کاربر وارد نشده است'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+
+    data = request_data(request)
+    password = data.get('password', '')
+    try:
+        group = await Group.objects.filter(id=int(data.get('group_id'))).afirst()
+    except (TypeError, ValueError):
+        group = None
+    if group is None:
+        return api_response(
+            {'status': 'error', 'message': 'گروه یافت نشد'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    if group.password:
+        address = request.META.get('REMOTE_ADDR', '')
+        account = f'{group.id}:{user_id}'
+        if await join_throttle.blocked(account, address):
+            return throttled_response()
+        if not await group.acheck_password(password):
+            await join_throttle.failed(account, address)
+            return api_response(
+                {'status': 'error', 'message': 'رمز عبور اشتباه است'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        await join_throttle.succeeded(account, address)
+
+    if await ais_group_member(group.id, user_id):
+        return api_response(
+            {'status': 'error', 'message': 'شما قبلاً عضو این گروه هستید'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    await sync_to_async(add_group_member)(group.id, user_id)
+    return api_response({'status': 'success', 'group_id': group.id})
 
 class MessageView(APIView):
     def get(self, request):
@@ -269,29 +404,31 @@ class MessageView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
-        last_message_id = request.GET.get('last_message_id', '0')
+        after_id = request.GET.get('after', request.GET.get('last_message_id', '0'))
+        before_id = request.GET.get('before', '0')
+        limit = request.GET.get('limit', MESSAGE_PAGE_SIZE)
         group_id = request.GET.get('group_id')
         recipient_id = request.GET.get('recipient_id')
 
         try:
-            last_message_id = int(last_message_id)
+            after_id = int(after_id)
+            before_id = int(before_id)
+            limit = min(max(int(limit), 1), MESSAGE_PAGE_MAX_SIZE)
         except ValueError:
             return Response(
                 {'status': 'error', 'message': 'شناسه پیام نامعتبر است'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        messages = Message.objects.filter(id__gt=last_message_id).select_related('sender', 'recipient', 'group').prefetch_related('files').order_by('timestamp')
-
         if group_id:
             try:
                 group_id = int(group_id)
-                if not Group.objects.filter(id=group_id, members__id=user_id).exists():
+                if not is_group_member(group_id, user_id):
                     return Response(
                         {'status': 'error', 'message': 'شما عضو این گروه نیستید'},
                         status=status.HTTP_403_FORBIDDEN
                     )
-                messages = messages.filter(group_id=group_id)
+                scope = models.Q(group_id=group_id)
             except ValueError:
                 return Response(
                     {'status': 'error', 'message': 'شناسه گروه نامعتبر است'},
@@ -300,7 +437,7 @@ class MessageView(APIView):
         elif recipient_id:
             try:
                 recipient_id = int(recipient_id)
-                messages = messages.filter(
+                scope = (
                     (models.Q(sender_id=user_id) & models.Q(recipient_id=recipient_id)) |
                     (models.Q(sender_id=recipient_id) & models.Q(recipient_id=user_id))
                 )
@@ -310,14 +447,16 @@ class MessageView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         else:
-            messages = messages.filter(
+            scope = (
                 models.Q(sender_id=user_id) |
                 models.Q(recipient_id=user_id) |
-                models.Q(group__members__id=user_id)
+                models.Q(group_id__in=Group.objects.filter(members__id=user_id).values('id'))
             )
 
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        # Keyset pagination on id: "after" catches up, "before" scrolls back,
+        # and no cursor returns the newest page. Pages are always oldest-first
+        # and continue into archived messages once the hot table runs out.
+        return Response(serialize_messages(history_page(scope, after_id, before_id, limit)))
 
     def post(self, request):
         user_id = request.session.get('user_id')
@@ -338,12 +477,24 @@ class MessageView(APIView):
                 {'status': 'error', 'message': 'محتوا یا فایل الزامی است'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if not group_id and not recipient_id:
+            return Response(
+                {'status': 'error', 'message': 'شناسه گیرنده یا گروه الزامی است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            file_ids = {int(file_id) for file_id in file_ids}
+        except (TypeError, ValueError):
+            return Response(
+                {'status': 'error', 'message': 'شناسه فایل نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
         message_data = {'sender_id': user_id, 'content': content}
         if group_id:
             try:
                 group_id = int(group_id)
-                if not Group.objects.filter(id=group_id, members__id=user_id).exists():
+                if not is_group_member(group_id, user_id):
                     return Response(
                         {'status': 'error', 'message': 'شما عضو این گروه نیستید'},
                         status=status.HTTP_403_FORBIDDEN
@@ -369,17 +520,108 @@ class MessageView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-        message = Message.objects.create(**message_data, delivered_at=timezone.now())
-        for file_id in file_ids:
-            file_obj = get_object_or_404(File, id=file_id)
-            file_obj.message = message
-            file_obj.save()
+        with transaction.atomic():
+            message = Message.objects.create(**message_data, delivered_at=timezone.now())
+            # Only the sender's own uploads that no message holds yet; anything else would expose
+            # someone else's file or take it off their message.
+            attached = File.objects.filter(
+                id__in=file_ids, uploader_id=user_id, message__isnull=True, archived_message__isnull=True
+            ).update(message=message)
+            if attached != len(file_ids):
+                transaction.set_rollback(True)
+                return Response(
+                    {'status': 'error', 'message': 'فایل یافت نشد'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
         if recipient_id:
             message.read_at = timezone.now()
             message.save()
+        record_message(message)
+
+        message_data = serialize_messages(Message.objects.filter(id=message.id).values(*MESSAGE_ROW_FIELDS))[0]
+        fan_out(message_data)
+        return Response({'status': 'success', 'message_id': message_data['id'], 'message': message_data})
+
+@csrf_exempt
+async def message_list(request):
+    """Entry point for /api/messages/; a GET with ``wait`` long-polls instead of returning an empty page.
+
+    Only the waiting is async, so an idle poll holds no thread. Every page,
+    and every other request, is answered by ``MessageView`` in one trip to
+    the sync thread rather than one per query, as the async ORM would make.
+    ``MessageSeenView`` and ``UserChattedView`` stay sync for the same reason.
+    """
+    message_view = sync_to_async(MessageView.as_view())
+    try:
+        wait = min(float(request.GET.get('wait', 0)), LONG_POLL_MAX_WAIT)
+        after_id = int(request.GET.get('after', request.GET.get('last_message_id', '0')))
+        group_id = int(request.GET.get('group_id') or 0)
+        recipient_id = int(request.GET.get('recipient_id') or 0)
+    except ValueError:
+        wait = 0
+    # Under WSGI a held request would tie up a worker thread, so ``wait`` is only honoured under ASGI.
+    if request.method != 'GET' or not wait > 0 or not after_id or not isinstance(request, ASGIRequest):
+        return await message_view(request)
+
+    user_id = await request.session.aget('user_id')
+    if not user_id:
+        return await message_view(request)
+
+    if group_id:
+        names = [chat_group_name(group_id)]
+    else:
+        names = [user_group_name(user_id)]
+        if not recipient_id:
+            async for member_group_id in Group.objects.filter(members__id=user_id).values_list('id', flat=True):
+                names.append(chat_group_name(member_group_id))
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    async with listen(names) as listener:
+        while True:
+            response = await message_view(request)
+            # Tells the client the wait was served, so it can chain the next poll straight away.
+            response['X-Long-Poll'] = '1'
+            remaining = deadline - loop.time()
+            if response.status_code != status.HTTP_200_OK or response.data or remaining <= 0:
+                return response
+            if not await listener.wait(remaining):
+                return response
+
+class MessageSearchView(APIView):
+    def get(self, request):
+        user_id = request.session.get('user_id')
+        if not user_id:
+            return Response(
+                {'status': 'error', 'message': 'کاربر وارد نشده است'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
 
-        serializer = MessageSerializer(message)
-        return Response({'status': 'success', 'message_id': serializer.data['id'], 'message': serializer.data})
+        query = request.GET.get('q', '').strip()
+        try:
+            offset = max(int(request.GET.get('offset', '0')), 0)
+            limit = min(max(int(request.GET.get('limit', SEARCH_PAGE_SIZE)), 1), SEARCH_PAGE_MAX_SIZE)
+            group_id = int(request.GET.get('group_id') or 0)
+            recipient_id = int(request.GET.get('recipient_id') or 0)
+        except ValueError:
+            return Response(
+                {'status': 'error', 'message': 'پارامترهای جستجو نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if group_id and not is_group_member(group_id, user_id):
+            return Response(
+                {'status': 'error', 'message': 'شما عضو این گروه نیستید'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        # One extra id tells us whether another page exists.
+        ids = search_messages(user_id, query, limit + 1, offset, group_id=group_id, peer_id=recipient_id)
+        rows = {row['id']: row for row in Message.objects.filter(id__in=ids[:limit]).values(*MESSAGE_ROW_FIELDS)}
+        messages = serialize_messages([rows[message_id] for message_id in ids[:limit] if message_id in rows])
+        return Response({
+            'messages': messages,
+            'next_offset': offset + limit if len(ids) > limit else None,
+        })
 
 class MessageDetailView(APIView):
     def patch(self, request, pk):
@@ -407,6 +649,7 @@ class MessageDetailView(APIView):
 
         message.content = content
         message.save()
+        record_edit(message)
         serializer = MessageSerializer(message)
         return Response({'status': 'success', 'message': serializer.data})
 
@@ -425,6 +668,7 @@ class MessageDetailView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
+        record_delete(message)
         message.delete()
         return Response({'status': 'success'})
 
@@ -444,23 +688,17 @@ class UploadView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        max_size = 20 * 1024 * 1024 * 1024
         file_ids = []
         for file in files:
-            if file.size > max_size:
+            if file.size > MAX_UPLOAD_SIZE:
                 return Response(
                     {'status': 'error', 'message': f'فایل {file.name} بیش از 20 گیگابایت است'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            file_extension = os.path.splitext(file.name)[1]
-            unique_filename = f"{timezone.now().strftime('%Y%m%d_%H%M%S')}_{random.randint(1000, 9999)}{file_extension}"
-            file_path = os.path.join('uploads', unique_filename)
-
             try:
-                saved_path = default_storage.save(file_path, file)
-                file_url = default_storage.url(saved_path)
-                full_path = os.path.join(settings.MEDIA_ROOT, saved_path)
+                blob, created = store_upload(hash_file(file), file.size, file.name, file.content_type,
+                                             lambda name: default_storage.save(name, file))
             except Exception as e:
                 logger.error(f"Error saving file {file.name}: {str(e)}")
                 return Response(
@@ -468,37 +706,12 @@ class UploadView(APIView):
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
 
-            file_type = 'other'
-            if file.content_type.startswith('image'):
-                file_type = 'image'
-                try:
-                    with Image.open(full_path) as img:
-                        img = img.convert('RGB')
-                        output_path = full_path.replace(unique_filename, f"compressed_{unique_filename}")
-                        img.save(output_path, quality=60, optimize=True)
-                        saved_path = saved_path.replace(unique_filename, f"compressed_{unique_filename}")
-                        if default_storage.exists(full_path):
-                            default_storage.delete(full_path)
-                except Exception as e:
-                    logger.error(f"Error compressing image {file.name}: {str(e)}")
-                    if default_storage.exists(saved_path):
-                        default_storage.delete(saved_path)
-                    return Response(
-                        {'status': 'error', 'message': f'خطا در فشرده‌سازی تصویر {file.name}: {str(e)}'},
-                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                    )
-            elif file.content_type.startswith('video'):
-                file_type = 'video'
-            elif file.content_type.startswith('audio'):
-                file_type = 'audio'
-
             try:
-                file_obj = File.objects.create(file=saved_path, file_type=file_type)
+                file_obj = create_file(blob, created, file.content_type, user_id)
                 file_ids.append(file_obj.id)
             except Exception as e:
-                logger.error(f"Error creating File object for {saved_path}: {str(e)}")
-                if default_storage.exists(saved_path):
-                    default_storage.delete(saved_path)
+                logger.error(f"Error creating File object for {blob.path}: {str(e)}")
+                release_blob(blob.id)
                 return Response(
                     {'status': 'error', 'message': f'خطا در ثبت فایل {file.name}: {str(e)}'},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -506,6 +719,136 @@ class UploadView(APIView):
 
         return Response({'status': 'success', 'file_ids': file_ids})
 
+class UploadSessionView(APIView):
+    def post(self, request):
+        user_id = request.session.get('user_id')
+        if not user_id:
+            return Response(
+                {'status': 'error', 'message': 'کاربر وارد نشده است'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        filename = request.data.get('filename', '').strip()
+        content_type = request.data.get('content_type', '')
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response(
+                {'status': 'error', 'message': 'حجم فایل نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not filename or size <= 0:
+            return Response(
+                {'status': 'error', 'message': 'نام و حجم فایل الزامی است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if size > MAX_UPLOAD_SIZE:
+            return Response(
+                {'status': 'error', 'message': f'فایل {filename} بیش از 20 گیگابایت است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        upload = start_upload(user_id, filename, size, content_type)
+        return Response({'status': 'success', 'upload_id': upload.id, 'offset': 0, 'size': size})
+
+class UploadSessionDetailView(APIView):
+    def get_upload(self, request, pk):
+        user_id = request.session.get('user_id')
+        if not user_id:
+            return None, Response(
+                {'status': 'error', 'message': 'کاربر وارد نشده است'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        return get_object_or_404(UploadSession, pk=pk, user_id=user_id), None
+
+    def get(self, request, pk):
+        upload, error = self.get_upload(request, pk)
+        if error:
+            return error
+        return Response({'upload_id': upload.id, 'offset': upload.received, 'size': upload.size,
+                         'file_id': upload.file_id})
+
+    def put(self, request, pk):
+        upload, error = self.get_upload(request, pk)
+        if error:
+            return error
+        if upload.file_id:
+            return Response(
+                {'status': 'error', 'message': 'این آپلود قبلاً ثبت شده است'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        content_range = parse_content_range(request.headers.get('Content-Range'))
+        try:
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            length = None
+        if content_range is None or length != content_range[1] - content_range[0] + 1:
+            return Response(
+                {'status': 'error', 'message': 'هدر Content-Range نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Read the raw body stream block by block; request.data would buffer the whole chunk.
+        try:
+            offset = write_chunk(upload, content_range[0], length, request.stream)
+        except OffsetMismatch as e:
+            return Response(
+                {'status': 'error', 'message': 'بازه ارسال‌شده با وضعیت آپلود همخوانی ندارد', 'offset': e.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+        except IncompleteChunk as e:
+            return Response(
+                {'status': 'error', 'message': 'بخش ارسالی ناقص است', 'offset': e.args[0]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except UploadError:
+            return Response(
+                {'status': 'error', 'message': 'بخش ارسالی از حجم فایل بیشتر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'status': 'success', 'offset': offset})
+
+    def delete(self, request, pk):
+        upload, error = self.get_upload(request, pk)
+        if error:
+            return error
+        abort_upload(upload)
+        return Response({'status': 'success'})
+
+class UploadCommitView(UploadSessionDetailView):
+    def post(self, request, pk):
+        upload, error = self.get_upload(request, pk)
+        if error:
+            return error
+        if upload.file_id:
+            return Response({'status': 'success', 'file_id': upload.file_id})
+
+        try:
+            file_obj, digest = commit_upload(upload, request.data.get('sha256'))
+        except AlreadyCommitted as e:
+            return Response(
+                {'status': 'error', 'message': 'این آپلود قبلاً ثبت شده است', 'file_id': e.file_id},
+                status=status.HTTP_409_CONFLICT
+            )
+        except OffsetMismatch as e:
+            return Response(
+                {'status': 'error', 'message': 'آپلود فایل کامل نشده است', 'offset': e.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+        except ChecksumMismatch:
+            return Response(
+                {'status': 'error', 'message': 'checksum فایل مطابقت ندارد'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            logger.error(f"Error committing upload {upload.id}: {str(e)}")
+            return Response(
+                {'status': 'error', 'message': f'خطا در ثبت فایل {upload.filename}: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        return Response({'status': 'success', 'file_id': file_obj.id, 'sha256': digest})
+
 class MessageSeenView(APIView):
     def post(self, request):
         user_id = request.session.get('user_id')
@@ -521,15 +864,9 @@ class MessageSeenView(APIView):
         if recipient_id:
             try:
                 recipient_id = int(recipient_id)
-                messages = Message.objects.filter(
-                    recipient_id=user_id, sender_id=recipient_id, read_at__isnull=True
-                )
-                for message in messages:
-                    if not message.delivered_at:
-                        message.delivered_at = timezone.now()
-                    message.read_at = timezone.now()
-                    message.save()
-                return Response({'status': 'success'})
+                message_ids = mark_read(user_id, peer_id=recipient_id)
+                publish_seen([user_group_name(recipient_id)], user_id, message_ids)
+                return Response({'status': 'success', 'message_ids': message_ids})
             except ValueError:
                 return Response(
                     {'status': 'error', 'message': 'شناسه گیرنده نامعتبر است'},
@@ -538,20 +875,14 @@ class MessageSeenView(APIView):
         elif group_id:
             try:
                 group_id = int(group_id)
-                if not Group.objects.filter(id=group_id, members__id=user_id).exists():
+                if not is_group_member(group_id, user_id):
                     return Response(
                         {'status': 'error', 'message': 'شما عضو این گروه نیستید'},
                         status=status.HTTP_403_FORBIDDEN
                     )
-                messages = Message.objects.filter(
-                    group_id=group_id, read_at__isnull=True
-                ).exclude(sender_id=user_id)
-                for message in messages:
-                    if not message.delivered_at:
-                        message.delivered_at = timezone.now()
-                    message.read_at = timezone.now()
-                    message.save()
-                return Response({'status': 'success'})
+                message_ids = mark_read(user_id, group_id=group_id)
+                publish_seen([chat_group_name(group_id)], user_id, message_ids)
+                return Response({'status': 'success', 'message_ids': message_ids})
             except ValueError:
                 return Response(
                     {'status': 'error', 'message': 'شناسه گروه نامعتبر است'},
@@ -566,8 +897,33 @@ class LogoutView(APIView):
     def post(self, request):
         user_id = request.session.get('user_id')
         if user_id:
-            user = get_object_or_404(User, id=user_id)
-            user.is_online = False
-            user.save()
+            go_offline(user_id)
             request.session.flush()
+        return Response({'status': 'success'})
+
+class PresenceView(APIView):
+    def get(self, request):
+        if not request.session.get('user_id'):
+            return Response(
+                {'status': 'error', 'message': 'کاربر وارد نشده است'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        try:
+            user_ids = [int(user_id) for user_id in request.GET.get('user_ids', '').split(',') if user_id][:PRESENCE_LOOKUP_MAX]
+        except ValueError:
+            return Response(
+                {'status': 'error', 'message': 'شناسه کاربران نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'online': sorted(online(user_ids))})
+
+    def post(self, request):
+        # Heartbeat for clients without a socket (the socket beats with its pings).
+        user_id = request.session.get('user_id')
+        if not user_id:
+            return Response(
+                {'status': 'error', 'message': 'کاربر وارد نشده است'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        heartbeat(user_id)
         return Response({'status': 'success'})
\ No newline at end of file
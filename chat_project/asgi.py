@@ -1,14 +1,16 @@
 import os
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from django.urls import re_path
 from chat.consumers import ChatConsumer
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
-
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter([
             re_path(r'^ws/chat/$', ChatConsumer.as_asgi()),
@@ -16,4 +18,4 @@ application = ProtocolTypeRouter({
     ),
 })
 
-print("ASGI application loaded with WebSocket route: ws/chat/")
\ No newline at end of file
+print("ASGI application loaded with WebSocket route: ws/chat/")
@@ -1,4 +1,5 @@
 # chat_project/settings.py
+import importlib.util
 import os
 from pathlib import Path
 
@@ -27,6 +28,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chat.middleware.ChatUserMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -50,13 +52,112 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'chat_project.wsgi.application'
+ASGI_APPLICATION = 'chat_project.asgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Redis برای ارسال پیام بین چند پروسه؛ بدون آن لایه حافظه‌ای (فقط یک پروسه) استفاده می‌شود
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
+
+# کش مشترک بین همه workerها؛ بدون Redis هر پروسه کش حافظه‌ای خودش را دارد (مناسب توسعه و تست)
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'chat',
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                'IGNORE_EXCEPTIONS': True,
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'KEY_PREFIX': 'chat',
+        }
     }
+
+# نشست‌ها: cached_db = خواندن از کش و فقط در نبود آن از دیتابیس (پیش‌فرض با Redis)،
+# db = پیش‌فرض بدون Redis، چون کش حافظه‌ای هر پروسه جداست و خروج در یک worker در بقیه دیده نمی‌شود،
+# signed_cookies = بدون هیچ ذخیره‌ای در سرور (اما خروج، کوکی‌های کپی‌شده را باطل نمی‌کند)
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get(
+    'SESSION_BACKEND', 'cached_db' if REDIS_URL else 'db'
+)
+
+# با تنظیم POSTGRES_DB از PostgreSQL استفاده می‌شود؛ در غیر این صورت SQLite
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'OPTIONS': {},
+        }
+    }
+    # pool مشترک psycopg (نیازمند psycopg[pool]) برای هر پروسه؛ بدون آن اتصال‌ها تا CONN_MAX_AGE ثانیه باز می‌مانند
+    DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+    if DB_POOL_MAX_SIZE:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': 10,
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH') or BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {},
+        }
+    }
+    # WAL: خواندن هم‌زمان با نوشتن؛ تراکنش IMMEDIATE قفل نوشتن را از ابتدا می‌گیرد تا
+    # به جای خطای "database is locked" تا busy_timeout منتظر بماند
+    if os.environ.get('SQLITE_TUNING', '1') == '1':
+        DATABASES['default']['OPTIONS'] = {
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=134217728;'
+                'PRAGMA busy_timeout=5000;'
+                'PRAGMA cache_size=-20000;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+        }
+
+# الگوریتم هش رمز عبور: argon2 (نیازمند argon2-cffi)، scrypt یا pbkdf2
+# هش‌های قدیمی همچنان بررسی می‌شوند و هنگام ورود با الگوریتم جدید بازنویسی می‌شوند
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'argon2' if importlib.util.find_spec('argon2') else 'scrypt')
+_PASSWORD_HASHERS = {
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
 }
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+# تعداد threadهای هش رمز عبور؛ پیش‌فرض یکی به ازای هر هسته
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -86,8 +187,24 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# ارسال فایل‌ها توسط وب‌سرور جلویی: x-accel (nginx) یا x-sendfile (apache)؛ خالی = ارسال توسط خود جنگو
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+# مسیر internal در nginx که به MEDIA_ROOT اشاره می‌کند
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# پیام‌های قدیمی‌تر از این تعداد روز با دستور archive_messages به جدول آرشیو منتقل می‌شوند
+MESSAGE_ARCHIVE_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_DAYS', 180))
+
 # برای آپلود فایل‌های بزرگ
-DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50 مگابایت
\ No newline at end of file
+DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50 مگابایت
+# پردازش پس‌زمینه فایل‌های رسانه‌ای:
+# process = استخر پردازه در همین سرور، redis = صف مشترک که دستور process_media آن را می‌خواند، inline = همزمان با درخواست
+MEDIA_QUEUE = os.environ.get('MEDIA_QUEUE', 'process')
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', '2'))
+# نسخه پخش ویدیو و صدا با ffmpeg: faststart = فقط انتقال ایندکس MP4 به ابتدای فایل بدون کدگذاری مجدد،
+# compact = کدگذاری مجدد با بیت‌ریت و ابعاد کمتر، خالی = فقط پوستر و مدت زمان
+MEDIA_RENDITION = os.environ.get('MEDIA_RENDITION', 'faststart')
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.environ.get('FFPROBE_BINARY', 'ffprobe')
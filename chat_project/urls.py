@@ -2,10 +2,11 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from chat.media import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('chat.urls')),
     path('', include('chat.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', serve_media, name='media'),
+]
\ No newline at end of file